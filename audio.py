@@ -0,0 +1,84 @@
+import array
+import glob
+import math
+import os
+
+import pygame
+
+import core
+
+class Audio(object):
+    """Play sound files and synthesised tones on the mixer's channels so
+    that nothing ever waits for a sound to finish. The wav files in the
+    media directory are loaded once, up front; each tone is synthesised
+    the first time it's needed and then kept.
+    """
+
+    media_dirpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "media")
+    volume = 0.5
+
+    #
+    # Array typecodes (and the offset of silence) for each mixer sample size
+    #
+    sample_formats = {
+        -8 : ("b", 0),
+        8 : ("B", 0x80),
+        -16 : ("h", 0),
+        16 : ("H", 0x8000),
+    }
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled and pygame.mixer.get_init() is not None
+        self.sounds = {}
+        self.tones = {}
+        if self.enabled:
+            self.load_sounds()
+        else:
+            core.log.info("Audio is disabled")
+
+    def load_sounds(self):
+        for filepath in glob.glob(os.path.join(self.media_dirpath, "*.wav")):
+            name = os.path.splitext(os.path.basename(filepath))[0]
+            self.sounds[name] = pygame.mixer.Sound(filepath)
+
+    def _synthesise(self, tones):
+        """Build a sound from a sequence of (frequency, duration in ms) sine tones
+        """
+        sample_rate, sample_size, n_channels = pygame.mixer.get_init()
+        typecode, silence = self.sample_formats[sample_size]
+        amplitude = self.volume * (2 ** (abs(sample_size) - 1) - 1)
+        samples = array.array(typecode)
+        for frequency, duration in tones:
+            step = 2.0 * math.pi * frequency / sample_rate
+            for n in xrange(sample_rate * duration / 1000):
+                samples.extend([silence + int(amplitude * math.sin(step * n))] * n_channels)
+        return pygame.mixer.Sound(buffer=samples)
+
+    def tone(self, *tones):
+        key = tuple((int(frequency), int(duration)) for frequency, duration in tones)
+        if key not in self.tones:
+            self.tones[key] = self._synthesise(key)
+        return self.tones[key]
+
+    def prepare(self, *sequences):
+        """Synthesise these sequences of (frequency, duration) tones ahead of time
+        """
+        if self.enabled:
+            for tones in sequences:
+                self.tone(*tones)
+
+    def _play(self, sound, maxtime=0):
+        channel = pygame.mixer.find_channel(True)
+        channel.play(sound, maxtime=maxtime)
+
+    def play(self, name, maxtime=0):
+        """Start playing one of the media files, by name without extension
+        """
+        if self.enabled:
+            self._play(self.sounds[name], maxtime)
+
+    def beep(self, *tones):
+        """Start playing one or more (frequency, duration) tones one after another
+        """
+        if self.enabled:
+            self._play(self.tone(*tones))
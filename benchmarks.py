@@ -0,0 +1,481 @@
+#!python2
+"""Timing harnesses for the quiz engine. Run one by name, eg:
+
+    python benchmarks.py countdown_drift 60 1
+"""
+import os, sys
+import cPickle
+import gc
+import itertools
+import json
+import platform
+import random
+import socket
+import subprocess
+import threading
+import time
+
+import pygame
+import Pyro4
+
+import core
+import quiz
+import replay
+import screen
+import screens
+import transport
+import wire
+
+clock = core.clock
+
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    return dict((point, values[min(len(values) - 1, len(values) * point / 100)]) for point in points)
+
+def countdown_drift(n_ticks=60, tick_interval_secs=1, max_lag_secs=0.05, tolerance_secs=0.01):
+    """Run a countdown timeline against the engine scheduler, stalling for
+    up to `max_lag_secs` after every tick as a busy frame would, and check
+    that the final tick lands within `tolerance_secs` of when it should.
+    """
+    n_ticks = int(n_ticks)
+    tick_interval_secs = float(tick_interval_secs)
+    max_lag_secs = float(max_lag_secs)
+    tolerance_secs = float(tolerance_secs)
+
+    scheduler = core.Scheduler()
+    timeline = core.Timeline(tick_interval_secs, n_ticks)
+    ticks = []
+
+    def on_timer():
+        for n in range(timeline.due()):
+            ticks.append(core.monotonic())
+        time.sleep(random.uniform(0, max_lag_secs))
+        deadline = timeline.next_deadline()
+        if deadline is not None:
+            scheduler.call_at(deadline, on_timer)
+
+    started_at = core.monotonic()
+    timeline.start(started_at)
+    scheduler.call_at(timeline.next_deadline(), on_timer)
+    while True:
+        deadline = scheduler.next_deadline()
+        if deadline is None:
+            break
+        time.sleep(max(0, deadline - core.monotonic()))
+        scheduler.run_due()
+
+    lateness = [t - (started_at + (n + 1) * tick_interval_secs) for n, t in enumerate(ticks)]
+    error = ticks[-1] - started_at - n_ticks * tick_interval_secs
+    print "%d ticks of %.3fs: expected %.3fs, took %.3fs (error %+.4fs)" % (
+        len(ticks), tick_interval_secs, n_ticks * tick_interval_secs, ticks[-1] - started_at, error
+    )
+    print "per-tick lateness: mean %.4fs, worst %.4fs" % (sum(lateness) / len(lateness), max(lateness))
+    return 0 if len(ticks) == n_ticks and abs(error) <= tolerance_secs else 1
+
+class PyroClient(object):
+    """Give the Pyro proxies the same put/get interface as transport.JSONClient
+    """
+
+    def __init__(self, port):
+        self.instructions = Pyro4.Proxy("PYRO:quiz.instructions@localhost:%d" % port)
+        self.feedback = Pyro4.Proxy("PYRO:quiz.feedback@localhost:%d" % port)
+        self.instructions._pyroBind()
+        self.subscriber_id = self.feedback.subscribe()
+
+    def put(self, action, *args):
+        self.instructions.put(action, *args)
+
+    def get(self):
+        return self.feedback.get_batch(self.subscriber_id, 1, None)[0]
+
+    def close(self):
+        self.feedback.unsubscribe(self.subscriber_id)
+        self.instructions._pyroRelease()
+        self.feedback._pyroRelease()
+
+def transport_latency(n_clients=50, n_messages=200, n_pings=500):
+    """Compare the Pyro and JSON transports on localhost: the rate at which
+    `n_clients` concurrent clients can each push `n_messages` instructions
+    into the engine's queue, and the round trip time of an instruction
+    answered with feedback.
+    """
+    n_clients = int(n_clients)
+    n_messages = int(n_messages)
+    n_pings = int(n_pings)
+
+    instructions = core.IPCQueue()
+    feedback = core.FeedbackHub(maxsize=n_pings)
+    received = threading.Condition()
+    counts = {"received" : 0}
+
+    def echo():
+        while True:
+            action, args, queued_at = instructions.get()
+            if action == "PING":
+                feedback.put("PONG", *args)
+            else:
+                with received:
+                    counts["received"] += 1
+                    received.notify_all()
+
+    servers = [
+        (transport.PyroTransport(port=1244), lambda: PyroClient(1244)),
+        (transport.JSONTransport(port=1245), lambda: transport.JSONClient(port=1245)),
+        (transport.WireTransport(port=1246), lambda: transport.WireClient(port=1246)),
+    ]
+    for server, client_factory in servers:
+        thread = threading.Thread(target=server.serve, args=(instructions, feedback))
+        thread.daemon = True
+        thread.start()
+    thread = threading.Thread(target=echo)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    for server, client_factory in servers:
+        #
+        # A thread-per-connection server may turn some clients away
+        #
+        clients = []
+        for n in range(n_clients):
+            try:
+                clients.append(client_factory())
+            except (socket.error, Pyro4.errors.CommunicationError), err:
+                print "%-5s refused client %d of %d: %s" % (server.name, 1 + n, n_clients, err)
+                break
+        counts["received"] = 0
+        expected = len(clients) * n_messages
+
+        def send(client):
+            for n in range(n_messages):
+                client.put("SCORE", "0", str(n))
+
+        started_at = core.monotonic()
+        senders = [threading.Thread(target=send, args=(client,)) for client in clients]
+        for sender in senders:
+            sender.start()
+        with received:
+            while counts["received"] < expected:
+                received.wait(1.0)
+        elapsed = core.monotonic() - started_at
+        for client in clients[1:]:
+            client.close()
+
+        client = clients[0]
+        round_trips = []
+        for n in range(n_pings):
+            sent_at = clock()
+            client.put("PING", n)
+            while client.get() != ("PONG", (n,)):
+                pass
+            round_trips.append(clock() - sent_at)
+        client.close()
+
+        latency = percentiles(round_trips)
+        print "%-5s %d clients: %.0f instructions/s; round trip p50 %.2fms p90 %.2fms p99 %.2fms" % (
+            server.name, len(clients), expected / elapsed, 1000 * latency[50], 1000 * latency[90], 1000 * latency[99]
+        )
+    return 0
+
+#
+# A typical evening's mix of instructions and feedback
+#
+sample_messages = [
+    ("SCORE", ("2", "17")),
+    ("SCORE", ("0", "5")),
+    ("name", (1, u"The Quizzy Rascals")),
+    ("SWITCH", ("left", "Countdown")),
+    ("LEFT", ("RESET", "60", "5", "1")),
+    ("RIGHT", ("style", "even_boxes")),
+    ("SCORES", ([12, 17, 9, 21],)),
+    ("TEAMS", ([u"Haddock", u"Kippers", u"Plaice", u"Trout"],)),
+    ("COLOURS", (["#ff0000", "#00ff00", "#ffff00", "#0000ff"],)),
+    ("left", ("COUNTDOWN", 42)),
+]
+
+def codecs():
+    yield "pickle", lambda action, args: cPickle.dumps((action, args), 2), cPickle.loads
+    try:
+        import serpent
+    except ImportError:
+        pass
+    else:
+        yield "serpent", lambda action, args: serpent.dumps((action, args)), serpent.loads
+    yield "json", lambda action, args: json.dumps([action] + list(args)), json.loads
+    yield "wire", wire.encode, wire.decode
+
+def codec_size(n_repeats=2000):
+    """Compare the bytes per message and the time to encode and decode a
+    typical mix of messages with the wire module against the general
+    purpose serialisers Pyro uses.
+    """
+    n_repeats = int(n_repeats)
+    for name, encode, decode in codecs():
+        encoded = [encode(action, args) for action, args in sample_messages]
+        started_at = clock()
+        for n in range(n_repeats):
+            for action, args in sample_messages:
+                encode(action, args)
+        encode_secs = clock() - started_at
+        started_at = clock()
+        for n in range(n_repeats):
+            for data in encoded:
+                decode(data)
+        decode_secs = clock() - started_at
+        n_messages = n_repeats * len(sample_messages)
+        print "%-8s %5.1f bytes/message; encode %5.2fus, decode %5.2fus" % (
+            name, float(sum(len(data) for data in encoded)) / len(encoded),
+            1e6 * encode_secs / n_messages, 1e6 * decode_secs / n_messages
+        )
+    return 0
+
+resolutions = [(400, 300), (800, 600), (1280, 720), (1920, 1080), (3840, 2160)]
+team_counts = [1, 4, 16, 50, 200]
+
+def _changer(engine, screen):
+    """Return a function which makes the smallest change a screen shows,
+    or None if it never changes.
+    """
+    counter = itertools.count()
+    if isinstance(screen, screens.Countdown):
+        def change():
+            if screen.n_tick > screen.n_ticks:
+                screen.do_reset(screen.n_ticks)
+                screen.do_start()
+                engine.render()
+            screen.do_tick()
+        screen.do_start()
+        return change
+    elif isinstance(screen, screens.Scores):
+        def change():
+            n = next(counter)
+            engine.do_score(n % len(engine.teams), n)
+        return change
+    elif isinstance(screen, screens.Splash):
+        return lambda: screen.do_reset("Round %d" % next(counter))
+    else:
+        return None
+
+def _time_frames(engine, screen, rect, n_frames, prepare):
+    timings = []
+    gc.collect()
+    n_objects = len(gc.get_objects())
+    font_misses, text_misses = core.fonts.misses, core.texts.misses
+    for n in range(n_frames):
+        prepare()
+        started_at = clock()
+        screen.render(engine.window, rect)
+        timings.append(clock() - started_at)
+    gc.collect()
+    return dict(
+        frames=n_frames,
+        objects_per_frame=float(len(gc.get_objects()) - n_objects) / n_frames,
+        font_misses_per_frame=float(core.fonts.misses - font_misses) / n_frames,
+        text_misses_per_frame=float(core.texts.misses - text_misses) / n_frames,
+        **dict(("p%d_ms" % point, 1000 * value) for point, value in percentiles(timings, (50, 90, 99, 100)).items())
+    )
+
+def _render_platform():
+    """Describe what the render timings depend on beyond the code: the
+    platform, pygame and SDL, the video driver and the font the screens
+    actually got.
+    """
+    return "%s; pygame %s; SDL %s; %s driver; %s" % (
+        platform.platform(), pygame.version.ver, ".".join(str(n) for n in pygame.get_sdl_version()),
+        pygame.display.get_driver(), core.fonts.find(screen.Screen.typeface) or "pygame's default font"
+    )
+
+def render_sweep(output_filepath="render-benchmark.json", n_frames=20, baseline_filepath=None, tolerance=0.25, min_regression_ms=0.1):
+    """Render every style of every screen on an offscreen engine across a
+    range of resolutions and (for the scoreboard) numbers of teams. Each
+    is timed both redrawing in full and updating after its smallest change.
+    The results go to `output_filepath` as JSON; if `baseline_filepath` names
+    an earlier set of results, report anything whose median frame time
+    has grown by more than `tolerance` and by at least `min_regression_ms`,
+    below which the difference is noise. Timings only compare on the same
+    platform and font, so each result records what it was rendered on.
+    """
+    n_frames = int(n_frames)
+    tolerance = float(tolerance)
+    min_regression_ms = float(min_regression_ms)
+    engine = quiz.Engine(transports="", headless=True, silent=True)
+    render_platform = _render_platform()
+    print "Rendering on", render_platform
+    results = []
+    for screen_name in screen.registry.names():
+        cls = screen.registry.get(screen_name)
+        for style in cls._styles():
+            for width, height in resolutions:
+                engine.do_resize((width, height))
+                for n_teams in (team_counts if cls is screens.Scores else [len(engine.teams)]):
+                    while len(engine.teams) > n_teams:
+                        engine.do_remove(len(engine.teams) - 1)
+                    for n_team in range(len(engine.teams), n_teams):
+                        engine.do_name(n_team, "Team %d" % (1 + n_team))
+                    engine.do_switch("left", cls.name)
+                    panel = engine.panels["left"]
+                    panel.do_style(style)
+                    rect = engine.panel_rects["left"]
+                    panel.render(engine.window, rect)
+
+                    def redraw():
+                        panel.is_dirty = True
+                    result = dict(screen=cls.name, style=style, width=width, height=height, n_teams=len(engine.teams), platform=render_platform)
+                    results.append(dict(result, mode="full", **_time_frames(engine, panel, rect, n_frames, redraw)))
+                    change = _changer(engine, panel)
+                    if change:
+                        results.append(dict(result, mode="update", **_time_frames(engine, panel, rect, n_frames, change)))
+                    engine.do_switch("left", "Blank")
+                    engine.check_pygame_events([engine])
+                    list(engine.instructions)
+                    print "%(screen)s %(style)s %(width)dx%(height)d %(n_teams)d teams" % result
+
+    with open(output_filepath, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print "Wrote %d results to %s" % (len(results), output_filepath)
+
+    if baseline_filepath:
+        key = lambda result: tuple(result[k] for k in ("screen", "style", "width", "height", "n_teams", "mode"))
+        with open(baseline_filepath) as f:
+            baseline = dict((key(result), result) for result in json.load(f))
+        baseline_platforms = set(result.get("platform") for result in baseline.values())
+        if baseline_platforms != set([render_platform]):
+            print "WARNING: the baseline was rendered on %s" % ", ".join(sorted(str(p) for p in baseline_platforms))
+        regressions = [
+            (result, baseline[key(result)]) for result in results
+                if key(result) in baseline
+                and result["p50_ms"] > (1 + tolerance) * baseline[key(result)]["p50_ms"]
+                and result["p50_ms"] - baseline[key(result)]["p50_ms"] >= min_regression_ms
+        ]
+        for result, base in regressions:
+            print "REGRESSION %s: p50 %.2fms (was %.2fms)" % (key(result), result["p50_ms"], base["p50_ms"])
+        return 1 if regressions else 0
+    return 0
+
+def replay_ramp(filepath, speeds="1,2,4,8,16,32,max", max_latency_ms=50):
+    """Replay a recording at increasing speeds and report the fastest at
+    which the engine still dispatched 99% of instructions within
+    `max_latency_ms` of their being queued.
+    """
+    max_latency_ms = float(max_latency_ms)
+    sustained = None
+    for speed in speeds.split(","):
+        speed = None if speed == "max" else float(speed)
+        stats = replay.replay(filepath, speed)
+        replay.report(stats, speed)
+        if 1000 * stats["latency_secs"].get("p99", 0) > max_latency_ms:
+            break
+        sustained = stats["n_instructions"] / max(stats["elapsed_secs"], 1e-6)
+    if sustained is None:
+        print "Latency exceeded %gms even at the slowest speed" % max_latency_ms
+        return 1
+    print "Sustained %.0f instructions/s within %gms" % (sustained, max_latency_ms)
+    return 0
+
+#
+# Run in a fresh interpreter to time one import from cold and report the
+# peak resident memory afterwards (where the platform can tell us)
+#
+import_probe = """
+import json, sys, time
+started = time.time()
+import %s
+elapsed_secs = time.time() - started
+try:
+    import resource
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+    max_rss_kb = None
+print json.dumps([elapsed_secs, max_rss_kb, "PyQt4" in sys.modules])
+"""
+
+def import_cost(n_runs=5, modules="quiz,widgets"):
+    """Time how long the engine (quiz) and the controller's widgets take to
+    import from cold, how much memory each process ends up holding and
+    whether Qt was loaded along the way.
+    """
+    n_runs = int(n_runs)
+    dirpath = os.path.dirname(os.path.abspath(__file__))
+    for module in modules.split(","):
+        timings = []
+        for n in range(n_runs):
+            try:
+                output = subprocess.check_output([sys.executable, "-c", import_probe % module], cwd=dirpath, stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError, err:
+                print "%s: unable to import\n%s" % (module, err.output.strip().splitlines()[-1])
+                break
+            timings.append(json.loads(output.strip().splitlines()[-1]))
+        else:
+            elapsed_secs = sorted(timing[0] for timing in timings)[len(timings) // 2]
+            max_rss_kb = max(timing[1] for timing in timings)
+            print "%-10s median %6.1fms  max RSS %s  Qt loaded: %s" % (
+                module, 1000 * elapsed_secs,
+                "%.1fMB" % (max_rss_kb / 1024.0) if max_rss_kb else "unknown",
+                "yes" if any(timing[2] for timing in timings) else "no"
+            )
+
+def cold_start(n_runs=5):
+    """Start a headless engine from cold, as the controller would, and time
+    how long it takes before feedback can be subscribed to and before the
+    first snapshot of teams, colours and scores comes back.
+    """
+    n_runs = int(n_runs)
+    dirpath = os.path.dirname(os.path.abspath(__file__))
+    uri = "PYRO:quiz.%s@localhost:1234"
+    try:
+        Pyro4.Proxy(uri % "feedback")._pyroBind()
+    except Pyro4.errors.CommunicationError:
+        pass
+    else:
+        print "An engine is already running on port 1234"
+        return 1
+
+    connect_secs, snapshot_secs = [], []
+    with open(os.devnull, "w") as devnull:
+        for n in range(n_runs):
+            started = clock()
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(dirpath, "quiz.py"), "--headless", "--silent"],
+                cwd=dirpath, stdout=devnull, stderr=devnull
+            )
+            try:
+                feedback = Pyro4.Proxy(uri % "feedback")
+                subscriber_id = core.backoff(lambda: feedback.subscribe(), Pyro4.errors.CommunicationError, timeout_secs=30)
+                connect_secs.append(clock() - started)
+                instructions = Pyro4.Proxy(uri % "instructions")
+                instructions.put_many([("TEAMS?", []), ("COLOURS?", []), ("SCORES?", [])])
+                expected = set(["TEAMS", "COLOURS", "SCORES"])
+                while expected:
+                    for message, args in feedback.get_batch(subscriber_id, 100, 10):
+                        expected.discard(message)
+                snapshot_secs.append(clock() - started)
+                instructions._pyroRelease()
+                feedback._pyroRelease()
+            finally:
+                process.terminate()
+                process.wait()
+
+    for label, timings in ("Subscribed", connect_secs), ("Snapshot", snapshot_secs):
+        points = percentiles(timings, (50, 90))
+        print "%-10s p50 %7.1fms  p90 %7.1fms  (%d runs)" % (label, 1000 * points[50], 1000 * points[90], len(timings))
+    return 0
+
+benchmarks = {
+    "cold_start" : cold_start,
+    "import_cost" : import_cost,
+    "render_sweep" : render_sweep,
+    "replay_ramp" : replay_ramp,
+    "codec_size" : codec_size,
+    "countdown_drift" : countdown_drift,
+    "transport_latency" : transport_latency,
+}
+
+def main(name=None, *args):
+    if name not in benchmarks:
+        print "Usage: benchmarks.py <%s> [args...]" % "|".join(sorted(benchmarks))
+        return 2
+    pygame.init()
+    return benchmarks[name](*args)
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
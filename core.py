@@ -1,17 +1,110 @@
+import os, sys
 import collections
+import heapq
+import inspect
+import itertools
 import json
 import logging
 import Queue
+import threading
+import time
+try:
+    from time import monotonic
+except ImportError:
+    def monotonic():
+        return pygame.time.get_ticks() / 1000.0
+
+#
+# A finer clock than monotonic for timing how long things take and for
+# stamping instructions as they're queued, eg to be recorded. Like
+# monotonic it must never step when the wall clock is corrected. Before
+# Python 3 that means time.clock on Windows and clock_gettime elsewhere;
+# time.time is the last resort.
+#
+def _clock_gettime():
+    import ctypes, ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    CLOCK_MONOTONIC = 1
+    for name in "c", "rt":
+        filepath = ctypes.util.find_library(name)
+        try:
+            clock_gettime = ctypes.CDLL(filepath, use_errno=True).clock_gettime
+        except (OSError, AttributeError, TypeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        def clock():
+            t = timespec()
+            clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t))
+            return t.tv_sec + t.tv_nsec * 1e-9
+        return clock
+    return None
+
+if hasattr(time, "perf_counter"):
+    clock = time.perf_counter
+elif sys.platform == "win32":
+    clock = time.clock
+else:
+    clock = _clock_gettime() or time.time
 
 import pygame
 
+class Histogram(object):
+    """Keep the most recent `size` samples of something, eg how long a
+    frame took to render, and summarise them on demand.
+    """
+
+    percentiles = 50, 90, 99
+
+    def __init__(self, size=1000):
+        self.samples = collections.deque(maxlen=size)
+        self.n_samples = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.n_samples += 1
+
+    def stats(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return dict(count=0)
+        stats = dict(
+            count=self.n_samples,
+            mean=sum(samples) / float(len(samples)),
+            max=samples[-1],
+        )
+        for percentile in self.percentiles:
+            stats["p%d" % percentile] = samples[int(round((len(samples) - 1) * percentile / 100.0))]
+        return stats
+
 #
 # NB Queue.Queue is an old-style class; you can't use super
 #
+# Each instruction is queued as (action, args, queued_at) so that the
+# engine can tell how long it waited to be dispatched.
+#
 class IPCQueue(Queue.Queue):
 
+    def __init__(self, maxsize=0, on_put=None):
+        Queue.Queue.__init__(self, maxsize)
+        self.on_put = on_put
+
     def put(self, action, *args):
-        Queue.Queue.put(self, (action, args))
+        Queue.Queue.put(self, (action, args, clock()))
+        if self.on_put:
+            self.on_put()
+
+    def put_many(self, items):
+        """Put a list of (action, args) in one go, eg from a remote client
+        which would otherwise need a round trip for each.
+        """
+        now = clock()
+        for action, args in items:
+            Queue.Queue.put(self, (action, tuple(args), now))
+        if items and self.on_put:
+            self.on_put()
 
     def __iter__(self):
         while True:
@@ -20,6 +113,212 @@ class IPCQueue(Queue.Queue):
             except Queue.Empty:
                 break
 
+class Subscriber(object):
+    """One subscriber's queue of feedback with a count of what it has been
+    sent and what has been dropped because it wasn't collected in time.
+    """
+
+    def __init__(self, maxsize, evictable=True):
+        self.messages = collections.deque(maxlen=maxsize)
+        self.n_delivered = self.n_dropped = 0
+        self.last_seen = monotonic()
+        self.waiters = []
+        self.evictable = evictable
+
+    @property
+    def is_waiting(self):
+        return bool(self.waiters)
+
+    def wake(self, waiter=None):
+        """Release one waiting get, or every one if `waiter` is None
+        """
+        for w in ([waiter] if waiter else list(self.waiters)):
+            if w in self.waiters:
+                self.waiters.remove(w)
+                self.last_seen = monotonic()
+                w.release()
+
+    def put(self, message, now):
+        if len(self.messages) == self.messages.maxlen:
+            self.n_dropped += 1
+        self.messages.append((now, message))
+
+    def get(self, now):
+        self.n_delivered += 1
+        put_at, message = self.messages.popleft()
+        return now - put_at, message
+
+    def stats(self, now):
+        return dict(
+            queued=len(self.messages),
+            delivered=self.n_delivered,
+            dropped=self.n_dropped,
+            lag_secs=(now - self.messages[0][0]) if self.messages else 0.0,
+            idle_secs=0.0 if self.is_waiting else now - self.last_seen,
+        )
+
+class FeedbackHub(object):
+    """Fan feedback out to every connected controller. Each subscriber gets
+    its own queue of at most `maxsize` messages; once that's full the oldest
+    is dropped. A subscriber which hasn't come back for `evict_after_secs`
+    is forgotten and must subscribe again, unless it subscribed as not
+    `evictable`: eg a socket connection, which unsubscribes when it closes.
+    """
+
+    def __init__(self, maxsize=256, evict_after_secs=60):
+        self.maxsize = maxsize
+        self.evict_after_secs = evict_after_secs
+        self.subscribers = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.delivery = Histogram()
+
+    def add_listener(self, callback):
+        """Have `callback` called, from the publishing thread, whenever a
+        message is put; eg to wake a transport's event loop.
+        """
+        self.listeners.append(callback)
+
+    def subscribe(self, maxsize=None, evictable=True):
+        """Return an id to be passed to get
+        """
+        with self.lock:
+            subscriber_id = next(self.counter)
+            self.subscribers[subscriber_id] = Subscriber(maxsize or self.maxsize, evictable)
+            return subscriber_id
+
+    def unsubscribe(self, subscriber_id):
+        with self.lock:
+            subscriber = self.subscribers.pop(subscriber_id, None)
+            if subscriber:
+                subscriber.wake()
+
+    def evict(self, now):
+        for subscriber_id, subscriber in self.subscribers.items():
+            if subscriber.evictable and not subscriber.is_waiting and now - subscriber.last_seen > self.evict_after_secs:
+                log.warn("Evicting feedback subscriber %s", subscriber_id)
+                del self.subscribers[subscriber_id]
+
+    def put(self, message, *args):
+        now = monotonic()
+        with self.lock:
+            self.evict(now)
+            for subscriber in self.subscribers.values():
+                subscriber.put((message, args), now)
+                subscriber.wake()
+        for callback in self.listeners:
+            callback()
+
+    def get(self, subscriber_id, timeout=None):
+        """Return the next (message, args) for this subscriber, waiting up to
+        `timeout` seconds for one to arrive; return None if none does.
+        Raises KeyError if the subscriber has been evicted.
+        """
+        messages = self.get_batch(subscriber_id, 1, timeout)
+        return messages[0] if messages else None
+
+    def get_batch(self, subscriber_id, max_items=100, timeout=None):
+        """Return up to `max_items` (message, args) pending for this
+        subscriber, waiting up to `timeout` seconds for the first to arrive;
+        return an empty list if none does. Raises KeyError if the subscriber
+        has been evicted.
+        """
+        #
+        # On Python 2 a wait with a timeout polls, sleeping for up to 50ms
+        # at a time, which would delay every message. Instead, block on a
+        # lock of our own with no timeout; put releases it as soon as
+        # there's a message and a timer releases it once `timeout` is up.
+        #
+        waiter = timer = None
+        with self.lock:
+            subscriber = self.subscribers[subscriber_id]
+            if not subscriber.messages and timeout != 0:
+                waiter = threading.Lock()
+                waiter.acquire()
+                subscriber.waiters.append(waiter)
+        if waiter:
+            if timeout is not None:
+                timer = threading.Timer(timeout, self.wake, (subscriber, waiter))
+                timer.daemon = True
+                timer.start()
+            waiter.acquire()
+            if timer:
+                timer.cancel()
+
+        with self.lock:
+            subscriber.last_seen = now = monotonic()
+            messages = []
+            for n in range(min(max_items, len(subscriber.messages))):
+                waited, message = subscriber.get(now)
+                self.delivery.add(waited)
+                messages.append(message)
+            return messages
+
+    def wake(self, subscriber, waiter):
+        with self.lock:
+            subscriber.wake(waiter)
+
+    def stats(self):
+        now = monotonic()
+        with self.lock:
+            return dict((subscriber_id, subscriber.stats(now)) for subscriber_id, subscriber in self.subscribers.items())
+
+    def delivery_stats(self):
+        """Summarise how long messages have waited between being put and
+        being collected by a subscriber.
+        """
+        with self.lock:
+            return self.delivery.stats()
+
+class VersionedState(object):
+    """A flat dictionary of everything a controller might show, eg
+    "team.0.score", whose version goes up with every change. The version at
+    which each key last changed is kept so the changes since any earlier
+    version can be returned; a key which has gone stays, with a value of
+    None. Versions only mean anything within an epoch, which is new each
+    time the state is created.
+    """
+
+    def __init__(self):
+        self.epoch = "%x" % int(time.time() * 1000)
+        self.version = 0
+        self.values = {}
+        self.changed_at = {}
+
+    def update(self, values):
+        """Bring the state into line with `values`, a complete snapshot,
+        and return the keys which changed.
+        """
+        changed = [key for key, value in values.items() if key not in self.values or self.values[key] != value]
+        changed.extend(key for key, value in self.values.items() if value is not None and key not in values)
+        if changed:
+            self.version += 1
+            for key in changed:
+                self.values[key] = values.get(key)
+                self.changed_at[key] = self.version
+        return changed
+
+    def since(self, version):
+        return dict((key, self.values[key]) for key, changed_at in self.changed_at.items() if changed_at > version)
+
+def backoff(function, exceptions, first_delay_secs=0.01, max_delay_secs=1.0, timeout_secs=None):
+    """Call `function` until it doesn't raise one of `exceptions` and return
+    whatever it returns. After each failure wait twice as long as the time
+    before, up to `max_delay_secs`. If `timeout_secs` is given and would be
+    exceeded, re-raise the last failure instead.
+    """
+    started = clock()
+    delay_secs = first_delay_secs
+    while True:
+        try:
+            return function()
+        except exceptions:
+            if timeout_secs is not None and clock() + delay_secs - started > timeout_secs:
+                raise
+            time.sleep(delay_secs)
+            delay_secs = min(2 * delay_secs, max_delay_secs)
+
 log = logging.getLogger("Quiz")
 log.setLevel(logging.DEBUG)
 handler = logging.StreamHandler()
@@ -27,6 +326,89 @@ handler.setFormatter(logging.Formatter("%(asctime)s %(module)s %(funcName)s %(le
 log.addHandler(handler)
 log.superdebug = log.debug
 
+def coerce(**converters):
+    """Decorate a do_/get_ handler to say how the arguments named should be
+    converted from the strings a controller usually sends. Arguments with
+    an int or float default are converted to that type without being named.
+    """
+    def decorator(function):
+        function.converters = converters
+        return function
+    return decorator
+
+def keywords(function):
+    """Decorate a do_/get_ handler to let a controller pass any of its
+    arguments as "name=value"
+    """
+    function.keywords = True
+    return function
+
+class Command(object):
+    """A handler for one verb, with its argument names and converters
+    worked out once when the command table for its class is built.
+    """
+
+    def __init__(self, verb, function):
+        spec = inspect.getargspec(function)
+        self.verb = verb
+        self.name = function.__name__
+        self.args = spec.args[1:]
+        self.varargs = spec.varargs
+        self.keywords = getattr(function, "keywords", False)
+        defaults = dict(zip(reversed(self.args), reversed(spec.defaults or ())))
+        converters = getattr(function, "converters", {})
+        self.converters = []
+        for arg in self.args:
+            default_type = type(defaults.get(arg))
+            self.converters.append(converters.get(arg) or (default_type if default_type in (int, float) else None))
+
+    def __repr__(self):
+        return "<%s %s(%s)>" % (self.__class__.__name__, self.verb, ", ".join(self.args))
+
+    def convert(self, args):
+        """Convert any string arguments according to the handler's converters
+        and return (args, kwargs). If the handler takes keywords, an argument
+        "name=value" where name is one of its arguments is passed by keyword.
+        Raises ValueError if any argument can't be converted.
+        """
+        positional, keywords = [], {}
+        for arg in args:
+            if self.keywords and isinstance(arg, basestring) and "=" in arg:
+                name, value = arg.split("=", 1)
+                if name in self.args:
+                    keywords[name] = value
+                    continue
+            positional.append(arg)
+        if set(keywords) & set(self.args[:len(positional)]):
+            raise ValueError("Arguments passed both by position and keyword")
+        converters = dict(zip(self.args, self.converters))
+        return [
+            (converter(arg) if converter and isinstance(arg, basestring) else arg)
+                for arg, converter in itertools.izip_longest(positional, self.converters[:len(positional)])
+        ], dict(
+            (name, converters[name](value) if converters[name] else value)
+                for name, value in keywords.items()
+        )
+
+_command_tables = {}
+
+def commands(cls):
+    """Return a dictionary mapping each verb a class handles to its Command:
+    do_x handles "x" and get_x handles "x?". The table is built once per class.
+    """
+    if cls not in _command_tables:
+        table = {}
+        for name in dir(cls):
+            if name.startswith("do_"):
+                verb = name[len("do_"):]
+            elif name.startswith("get_"):
+                verb = name[len("get_"):] + "?"
+            else:
+                continue
+            table[verb] = Command(verb, getattr(cls, name))
+        _command_tables[cls] = table
+    return _command_tables[cls]
+
 class Color(pygame.Color):
 
     light = pygame.Color("white")
@@ -43,13 +425,14 @@ class Font(pygame.font.Font):
 
     def __init__(self, *args, **kwargs):
         pygame.font.Font.__init__(self, *args, **kwargs)
+        self.key = args
 
     def render(self, text, colour):
         return pygame.font.Font.render(self, text, False, colour)
 
     def render_hollow(self, message, colour):
         notcolor = [c^0xFF for c in colour]
-        base = self.render(message, 0, colour, notcolor)
+        base = pygame.font.Font.render(self, message, False, colour, notcolor)
         size = base.get_width() + 2, base.get_height() + 2
         img = pygame.Surface(size, 16)
         img.fill(notcolor)
@@ -65,7 +448,7 @@ class Font(pygame.font.Font):
         return img
 
     def render_outlined(self, message, colour, outline_colour):
-        base = self.render(message, 0, colour)
+        base = pygame.font.Font.render(self, message, False, colour)
         outline = self.render_hollow(message, outline_colour)
         img = pygame.Surface(outline.get_size(), 16)
         img.blit(base, (1, 1))
@@ -73,5 +456,213 @@ class Font(pygame.font.Font):
         img.set_colorkey(0)
         return img
 
-timer_event_type = pygame.USEREVENT + 1
-scores_changed_event = pygame.event.Event(pygame.USEREVENT + 2)
+class FontCache(object):
+    """Hold loaded fonts keyed on typeface and pixel size so that renderers
+    needn't reload the font file on every frame. At most `max_entries`
+    fonts are kept; the least recently used is discarded to make room.
+    A typeface whose file isn't there, eg the Windows default on another
+    platform, is replaced by pygame's own font.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.fonts = collections.OrderedDict()
+        self.hits = self.misses = 0
+        self.missing = set()
+
+    def get(self, typeface, size):
+        key = typeface, max(1, int(size))
+        try:
+            font = self.fonts.pop(key)
+        except KeyError:
+            self.misses += 1
+            font = Font(self.find(typeface), key[1])
+            self.trim(self.max_entries - 1)
+        else:
+            self.hits += 1
+        self.fonts[key] = font
+        return font
+
+    def find(self, typeface):
+        if typeface is None or os.path.exists(typeface):
+            return typeface
+        if typeface not in self.missing:
+            log.warn("No typeface at %s; using pygame's default font", typeface)
+            self.missing.add(typeface)
+        return None
+
+    def trim(self, max_entries):
+        while len(self.fonts) > max(0, max_entries):
+            self.fonts.popitem(last=False)
+
+    def set_max_entries(self, max_entries):
+        self.max_entries = max_entries
+        self.trim(max_entries)
+
+    def clear(self):
+        self.fonts.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(entries=len(self.fonts), max_entries=self.max_entries, hits=self.hits, misses=self.misses)
+
+fonts = FontCache()
+
+def get_font(typeface, size):
+    """Return a (possibly cached) font for this typeface at this pixel size
+    """
+    return fonts.get(typeface, size)
+
+class TextCache(object):
+    """Hold rendered text surfaces keyed on font, style, text and colours so
+    that a frame which shows the same text as the last one rasterises nothing.
+    The total size of the cached surfaces is kept below `max_bytes` by
+    discarding the least recently used.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.surfaces = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def render(self, font, text, colour):
+        return self.get(font, "plain", text, colour)
+
+    def render_hollow(self, font, text, colour):
+        return self.get(font, "hollow", text, colour)
+
+    def render_outlined(self, font, text, colour, outline_colour):
+        return self.get(font, "outlined", text, colour, outline_colour)
+
+    def get(self, font, style, text, *colours):
+        key = (font.key, style, text) + tuple(tuple(c) for c in colours)
+        try:
+            surface = self.surfaces.pop(key)
+        except KeyError:
+            self.misses += 1
+            renderer = font.render if style == "plain" else getattr(font, "render_" + style)
+            surface = renderer(text, *colours)
+            self.n_bytes += self._size(surface)
+            self.trim(self.max_bytes)
+        else:
+            self.hits += 1
+        self.surfaces[key] = surface
+        return surface
+
+    @staticmethod
+    def _size(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def _remove(self, key):
+        self.n_bytes -= self._size(self.surfaces.pop(key))
+
+    def trim(self, max_bytes):
+        while self.surfaces and self.n_bytes > max_bytes:
+            self._remove(next(iter(self.surfaces)))
+
+    def discard(self, text=None, colour=None):
+        """Drop any surfaces showing this text or rendered in this colour,
+        eg when a team is renamed or recoloured.
+        """
+        colour = colour and tuple(colour)
+        for key in list(self.surfaces):
+            (_, _, key_text), key_colours = key[:3], key[3:]
+            if text is not None and key_text == text:
+                self._remove(key)
+            elif colour is not None and colour in key_colours:
+                self._remove(key)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.n_bytes = 0
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(entries=len(self.surfaces), bytes=self.n_bytes, max_bytes=self.max_bytes, hits=self.hits, misses=self.misses)
+
+texts = TextCache()
+
+changed_event_type = pygame.USEREVENT + 2
+instruction_event_type = pygame.USEREVENT + 3
+deadline_event_type = pygame.USEREVENT + 4
+
+def changed_event(what, **kwargs):
+    """Build the event the engine passes to each panel when something it might
+    display has changed: `what` is one of "scores", "names", "colours" or
+    "teams" (a team added or removed).
+    """
+    return pygame.event.Event(changed_event_type, what=what, **kwargs)
+
+class Scheduler(object):
+    """Hold callbacks to be run once the monotonic clock reaches their
+    deadlines. The engine sleeps until the earliest of these.
+    """
+
+    def __init__(self):
+        self.timers = []
+        self.counter = itertools.count()
+
+    def call_at(self, deadline, callback, *args):
+        timer = [deadline, next(self.counter), callback, args]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(monotonic() + delay, callback, *args)
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    def next_deadline(self):
+        while self.timers and self.timers[0][2] is None:
+            heapq.heappop(self.timers)
+        return self.timers[0][0] if self.timers else None
+
+    def run_due(self, now=None):
+        if now is None:
+            now = monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            deadline, _, callback, args = heapq.heappop(self.timers)
+            if callback is not None:
+                callback(*args)
+
+class Timeline(object):
+    """A schedule of `n_steps` ticks, one every `interval` seconds, on the
+    monotonic clock. Each deadline is reckoned from the start rather than
+    from the tick before so lateness never accumulates: ticks which are
+    noticed late are simply all due at once.
+    """
+
+    def __init__(self, interval, n_steps):
+        self.interval = interval
+        self.n_steps = n_steps
+        self.n_done = 0
+        self.started_at = None
+
+    def start(self, now=None):
+        """Start or resume the timeline; a resumed timeline picks up from the
+        last tick which fell due.
+        """
+        if now is None:
+            now = monotonic()
+        self.started_at = now - self.n_done * self.interval
+
+    def pause(self):
+        self.started_at = None
+
+    def next_deadline(self):
+        if self.started_at is None or self.n_done >= self.n_steps:
+            return None
+        return self.started_at + (self.n_done + 1) * self.interval
+
+    def due(self, now=None):
+        """Return the number of ticks which have fallen due since the last call
+        """
+        if self.started_at is None:
+            return 0
+        if now is None:
+            now = monotonic()
+        n_due = min(self.n_steps, int((now - self.started_at) / self.interval))
+        n_new, self.n_done = max(0, n_due - self.n_done), max(n_due, self.n_done)
+        return n_new
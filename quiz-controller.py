@@ -1,30 +1,95 @@
 #!python2
 import os, sys
-import socket
+import Queue
 import subprocess
+import threading
+import time
 
 import Pyro4
 from PyQt4 import QtCore, QtGui
 
 import core
-import screen
-import screens
+import widgets
 
 class FeedbackReader(QtCore.QThread):
+    """Subscribe to the engine's feedback, waiting for the engine to come up
+    if need be, and pass on whatever arrives. `connected` is emitted each
+    time a new subscription is made: anything asked of the engine after
+    that is certain to be answered to this reader.
+    """
 
-    message_received = QtCore.pyqtSignal(unicode, tuple)
+    messages_received = QtCore.pyqtSignal(list)
+    connected = QtCore.pyqtSignal()
+    poll_secs = 10
+    max_batch = 100
 
     def __init__(self, proxy):
         super(FeedbackReader, self).__init__()
         self.feedback = proxy
 
+    def subscribe(self):
+        subscriber_id = core.backoff(lambda: self.feedback.subscribe(), Pyro4.errors.CommunicationError)
+        self.connected.emit()
+        return subscriber_id
+
     def run(self):
+        subscriber_id = self.subscribe()
         while True:
-            feedback = self.feedback.get()
+            try:
+                feedback = self.feedback.get_batch(subscriber_id, self.max_batch, self.poll_secs)
+            except KeyError:
+                core.log.warn("Feedback subscription lapsed; subscribing again")
+                subscriber_id = self.subscribe()
+                continue
+            except Pyro4.errors.CommunicationError:
+                core.log.warn("Lost touch with the engine; subscribing again")
+                subscriber_id = self.subscribe()
+                continue
             core.log.debug("feedback: %r", feedback)
             if feedback:
-                message, args = feedback
-                self.message_received.emit(message, args)
+                self.messages_received.emit([(message, tuple(args)) for message, args in feedback])
+
+class CommandSender(threading.Thread):
+    """Collect commands from the UI and send them to the engine from a
+    background thread, a batch at a time, so the UI never waits on the
+    network. Commands arriving within `batch_secs` of each other go together.
+    A batch which can't be sent, eg because the engine is still starting,
+    is retried until it can be.
+    """
+
+    batch_secs = 0.005
+
+    def __init__(self, uri):
+        super(CommandSender, self).__init__()
+        self.daemon = True
+        self.uri = uri
+        self.commands = Queue.Queue()
+
+    def send(self, message, *args):
+        self.commands.put((message, args))
+
+    def next_batch(self):
+        batch = [self.commands.get()]
+        deadline = time.time() + self.batch_secs
+        while True:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    batch.append(self.commands.get(timeout=timeout))
+                else:
+                    batch.append(self.commands.get_nowait())
+            except Queue.Empty:
+                return batch
+
+    def run(self):
+        #
+        # A Pyro proxy mustn't be shared between threads so this one
+        # belongs to the sender alone.
+        #
+        instructions = Pyro4.Proxy(self.uri)
+        while True:
+            batch = self.next_batch()
+            core.backoff(lambda: instructions.put_many(batch), Pyro4.errors.CommunicationError)
 
 class Panel(QtGui.QGroupBox):
 
@@ -42,7 +107,7 @@ class Panel(QtGui.QGroupBox):
         layout.addWidget(self.stack)
         self.setLayout(layout)
 
-        for cls in screen.ScreenWidget.__subclasses__():
+        for cls in widgets.ScreenWidget.__subclasses__():
             self.selector.addItem(cls.name)
             self.stack.addWidget(cls(controller, position))
 
@@ -52,18 +117,52 @@ class Panel(QtGui.QGroupBox):
         screen_name = unicode(self.selector.itemText(index))
         self.instructions.send_command("SWITCH", self.position, screen_name)
 
+    def show_screen(self, screen_name):
+        """Show the screen the engine says this panel has without sending
+        a SWITCH back to it
+        """
+        index = self.selector.findText(screen_name)
+        if index >= 0 and index != self.selector.currentIndex():
+            was_blocked = self.selector.blockSignals(True)
+            try:
+                self.selector.setCurrentIndex(index)
+            finally:
+                self.selector.blockSignals(was_blocked)
+            self.stack.setCurrentIndex(index)
+
 class QuizController(QtGui.QWidget):
 
     COMMAND_MAILSLOT_NAME = "quiz"
     RESPONSE_MAILSLOT_NAME = "sub"
+    engine_uri = "PYRO:quiz.%s@localhost:1234"
+
+    #
+    # For each team field updated from the engine: which of the team's
+    # widgets shows it, that widget's getter and setter, and how to
+    # format an incoming value for the setter.
+    #
+    team_fields = {
+        "name" : (0, "text", "setText", unicode),
+        "score" : (1, "text", "setText", unicode),
+        "colour" : (0, "styleSheet", "setStyleSheet", lambda colour: "* { background-color : %s; }" % colour),
+    }
 
     def __init__(self, *args, **kwargs):
         super(QuizController, self).__init__(*args, **kwargs)
         self.setWindowTitle("Quiz Controller")
-
-        self.instructions = Pyro4.Proxy("PYRO:quiz.instructions@localhost:1234")
-        self.responder = FeedbackReader(Pyro4.Proxy("PYRO:quiz.feedback@localhost:1234"))
-        self.responder.message_received.connect(self.handle_response)
+        self.pending_updates = {}
+        #
+        # The engine's state as last synced; see Engine.get_state
+        #
+        self.state = {}
+        self.state_epoch = None
+        self.state_version = 0
+
+        self.sender = CommandSender(self.engine_uri % "instructions")
+        self.sender.start()
+        self.responder = FeedbackReader(Pyro4.Proxy(self.engine_uri % "feedback"))
+        self.responder.messages_received.connect(self.handle_responses)
+        self.responder.connected.connect(self.on_connected)
         self.responder.start()
 
         overall_layout = QtGui.QVBoxLayout()
@@ -78,13 +177,17 @@ class QuizController(QtGui.QWidget):
         self.add_controller(overall_layout)
         self.setLayout(overall_layout)
 
-        #
-        # The first response is always lost. Not sure why.
-        #
-        self.send_command("COLOURS?")
-        self.send_command("COLOURS?")
-        self.send_command("SCORES?")
-        self.send_command("TEAMS?")
+    def on_connected(self):
+        """Now that the engine's feedback will reach us, catch up with
+        whatever has changed since we last heard from it.
+        """
+        self.request_state()
+
+    def request_state(self):
+        args = ["since=%d" % self.state_version]
+        if self.state_epoch:
+            args.append("epoch=%s" % self.state_epoch)
+        self.send_command("STATE?", *args)
 
     def add_teams(self, overall_layout):
         self.teams = []
@@ -108,8 +211,6 @@ class QuizController(QtGui.QWidget):
 
             def set_team_name(new_name, n_team=i, team_name=team_name, team_score=team_score):
                 self.send_command("name", n_team, unicode(team_name.text()))
-                if not team_name.styleSheet():
-                    self.send_command("COLOURS?")
             def set_team_score(new_score, n_team=i):
                 self.send_command("SCORE", str(n_team), str(new_score))
             def set_team_plus(n_team=i, team_score=team_score):
@@ -154,7 +255,7 @@ class QuizController(QtGui.QWidget):
         core.log.debug("send_command: %s", command)
         if hasattr(self, "command"):
             self.command.setText(command)
-        self.instructions.put(message, *args)
+        self.sender.send(message, *args)
 
     def position_widget(self, position):
         return self.groups.get(position.lower())
@@ -202,32 +303,118 @@ class QuizController(QtGui.QWidget):
     #~ def handle_right(self, *args, **kwargs):
         #~ self._handle_position("right", *args, **kwargs)
 
+    def update_teams(self, field, values):
+        """Note new values for one field of each team. They're applied to the
+        widgets together once control returns to the Qt event loop, so a
+        burst of feedback costs one repaint.
+        """
+        for n_team, value in enumerate(values):
+            self.update_team(n_team, field, value)
+
+    def update_team(self, n_team, field, value):
+        if n_team >= len(self.teams) or field not in self.team_fields:
+            return
+        if not self.pending_updates:
+            QtCore.QTimer.singleShot(0, self.apply_updates)
+        self.pending_updates[n_team, field] = value
+
+    def apply_updates(self):
+        """Apply the pending updates which differ from what the widgets already
+        show. Signals are blocked meanwhile so that updating a score doesn't
+        echo a SCORE command back to the engine.
+        """
+        updates, self.pending_updates = self.pending_updates, {}
+        self.setUpdatesEnabled(False)
+        try:
+            for (n_team, field), value in sorted(updates.items()):
+                n_widget, getter, setter, formatter = self.team_fields[field]
+                widget = self.teams[n_team][n_widget]
+                value = u"" if value is None else formatter(value)
+                if unicode(getattr(widget, getter)()) != value:
+                    was_blocked = widget.blockSignals(True)
+                    try:
+                        getattr(widget, setter)(value)
+                    finally:
+                        widget.blockSignals(was_blocked)
+        finally:
+            self.setUpdatesEnabled(True)
+
     def handle_teams(self, teams):
-        for n_team, new_name in enumerate(teams):
-            name, _, _, _ = self.teams[n_team]
-            name.setText(new_name)
+        self.update_teams("name", teams)
 
     def handle_colours(self, colours):
-        for n_team, new_colour in enumerate(colours):
-            name, _, _, _ = self.teams[n_team]
-            name.setStyleSheet("* { background-color : %s; }" % new_colour)
+        self.update_teams("colour", colours)
 
     def handle_scores(self, scores):
-        for n_team, new_score in enumerate(scores):
-            _, score, _, _ = self.teams[n_team]
-            score.setText(unicode(new_score))
+        self.update_teams("score", scores)
+
+    def handle_state(self, state):
+        """Apply a reply to STATE?: everything if it's full, otherwise only
+        what changed since the version it was asked from. Every controller
+        sees every reply, so one may have been asked from a later version
+        than ours; if so, there's a gap and we must ask for ourselves.
+        """
+        is_current_epoch = state["epoch"] == self.state_epoch
+        if state["full"]:
+            if is_current_epoch and state["version"] < self.state_version:
+                return
+            changes = dict((key, None) for key in self.state)
+            changes.update(state["changes"])
+        elif not is_current_epoch or state["version"] <= self.state_version:
+            return
+        elif state["since"] > self.state_version:
+            self.request_state()
+            return
+        else:
+            changes = state["changes"]
+        self.apply_state(state["epoch"], state["version"], changes)
+
+    def handle_delta(self, delta):
+        """Apply the changes the engine pushes as they happen. If any have
+        been missed, eg while reconnecting, ask for them.
+        """
+        if delta["epoch"] != self.state_epoch or delta["version"] <= self.state_version:
+            return
+        if delta["since"] > self.state_version:
+            self.request_state()
+            return
+        self.apply_state(delta["epoch"], delta["version"], delta["changes"])
+
+    def apply_state(self, epoch, version, changes):
+        self.state_epoch, self.state_version = epoch, version
+        self.state.update(changes)
+        for key, value in changes.items():
+            parts = key.split(".")
+            if parts[0] == "team" and len(parts) == 3:
+                self.update_team(int(parts[1]), parts[2], value)
+            elif len(parts) == 2 and parts[1] == "screen" and parts[0] in self.panels and value:
+                self.panels[parts[0]].show_screen(value)
 
     def handle_quit(self):
         self.close()
 
+    def handle_responses(self, messages):
+        for message, args in messages:
+            self.handle_response(message, args)
+        message, args = messages[-1]
+        self.responses.setText("%s %s" % (message, " ".join("%r" % arg for arg in args)))
+
     def handle_response(self, message, args):
         core.log.debug("Response received: %s, %s", message, args)
         message = unicode(message)
-        response = "%s %s" % (message, " ".join("%r" % arg for arg in args))
-        self.responses.setText(response)
         handler = getattr(self, "handle_" + message.lower(), self.handle_default)
         return handler(*args)
 
+def start_engine():
+    """Start the engine unless one is already answering. The controller
+    doesn't wait for it: its sender and reader keep trying until the
+    engine is ready.
+    """
+    try:
+        Pyro4.Proxy(QuizController.engine_uri % "feedback")._pyroBind()
+    except Pyro4.errors.CommunicationError:
+        subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "quiz.py")])
+
 def main():
     app = QtGui.QApplication([])
     quiz_controller = QuizController()
@@ -235,8 +422,5 @@ def main():
     return app.exec_()
 
 if __name__ == '__main__':
-    try:
-        socket.socket().connect(("localhost", 1234))
-    except socket.error:
-        subprocess.Popen([sys.executable, "quiz.py"])
+    start_engine()
     sys.exit(main(*sys.argv[1:]))
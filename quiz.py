@@ -1,48 +1,32 @@
 #!python2
 import os, sys
-import inspect
+import argparse
+import collections
 import itertools
+import math
 import threading
-try:
-    import winsound
-    def beep(frequency, duration):
-        winsound.Beep(frequency, duration)
-except ImportError:
-    def beep(frequency, duration):
-        pass
 
 import pygame
-import Pyro4
 
+import audio
 import core
+import recording
 import screen
-import screens
+import transport
 
 #
 # Little piece of black magic to ensure no lag
 # occurs when playing sound. Must be done before
-# pygame.init
+# pygame.init (which happens when the Engine starts)
 #
 pygame.mixer.pre_init(44100, -16, 2, 1024)
-pygame.init()
-
-def manage_instructions(instructions, feedback):
-    daemon = Pyro4.Daemon(port=1234)
-    Pyro4.Daemon.serveSimple(
-        {
-            instructions : "quiz.instructions",
-            feedback : "quiz.feedback"
-        },
-        daemon=daemon,
-        ns=False
-    )
 
 class Team(object):
     """A team is mostly a Bunch class with a cycle of colours to choose from
     """
 
     colours = itertools.cycle(["red", "green", "yellow", "blue", "purple", "orange", "royalblue", "salmon", "wheat"])
-    names = iter(["Haddock", "Kippers", "Plaice", "Trout", "Salmon", "Halibut"])
+    names = itertools.cycle(["Haddock", "Kippers", "Plaice", "Trout", "Salmon", "Halibut"])
 
     def __init__(self, name, score=0):
         self.colour = core.Color(self.colours.next())
@@ -62,52 +46,269 @@ class Engine(object):
     window_rect = core.Rect(0, 0, 400, 300)
     window_flags = pygame.RESIZABLE
     background_colour = core.Color.light
-
-    def __init__(self):
+    #
+    # Frame rate cap while any panel is animating; None for no animation
+    #
+    max_fps = 30
+    #
+    # Instructions for which only the last of a batch matters, with the
+    # number of leading arguments which say what they apply to. Those
+    # for a panel are passed through LEFT or RIGHT.
+    #
+    coalesced_verbs = {"score" : 1, "name" : 1}
+    coalesced_panel_verbs = {"reset" : 0, "style" : 0}
+    #
+    # Verbs the engine answers itself even when a panel has a handler of
+    # the same name; the panel's is still reached through LEFT or RIGHT.
+    #
+    engine_verbs = {"state?"}
+    score_up_tones = (1440, 100), (2880, 200)
+    score_down_tones = (440, 100), (220, 200)
+    #
+    # Each .py file here is declared as a screen named for the file; see
+    # screen.Registry
+    #
+    plugins_dirpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugins")
+    ready_timeout_secs = 10
+
+    def __init__(self, transports="pyro", headless=False, silent=False, frame_dirpath=None, record_filepath=None, plugins_dirpath=None, prewarm=""):
         """Create the instruction and feedback queues and default the screen
         to a left-handle splash panel and a right hand scores stack with no
-        teams defined.
+        teams defined. `transports` is a comma-separated list of the ways
+        controllers can connect; see transport.transports.
+
+        A headless engine needs no display: it renders into an offscreen
+        surface and, if `frame_dirpath` is given, saves each frame which
+        changed there as a PNG. A silent engine plays no sounds.
+
+        If `record_filepath` is given, every instruction received is
+        recorded there so it can be played back later by replay.py.
+
+        Screens are only imported when first switched to. `prewarm` is a
+        comma-separated list of screens to import in the background as soon
+        as the engine starts.
         """
-        self.instructions = core.IPCQueue()
-        self.feedback = core.IPCQueue()
+        self.headless = headless
+        self.frame_dirpath = frame_dirpath
+        self.n_frame = 0
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+        if silent:
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+        pygame.init()
+
+        self.transports = [transport.transports[name.strip().lower()]() for name in transports.split(",") if name.strip()]
+        self.instructions = core.IPCQueue(on_put=self.wake)
+        self.wake_pending = False
+        self.coalesced = collections.Counter()
+        self.render_secs = collections.defaultdict(core.Histogram)
+        self.frame_secs = core.Histogram()
+        self.events_secs = core.Histogram()
+        self.queue_depth = core.Histogram()
+        self.dispatch_latency_secs = collections.defaultdict(core.Histogram)
+        self.publish_secs = core.Histogram()
+        self.scheduler = core.Scheduler()
+        self.last_frame = 0
+        self.feedback = core.FeedbackHub()
+        self.state = core.VersionedState()
+        self.ready = threading.Event()
+        self.ready_secs = {}
+        self.recorder = recording.Recorder(record_filepath) if record_filepath else None
+        screen.registry.discover(plugins_dirpath or self.plugins_dirpath)
         self.panels = {
-            "left" : screens.Blank(self),
-            "right" : screens.Blank(self)
+            "left" : screen.registry.get("blank")(self),
+            "right" : screen.registry.get("blank")(self)
         }
         self.teams = []
+        self.build_dispatch()
+        self.needs_flip = True
+        self.audio = audio.Audio(enabled=not silent)
+        self.audio.prepare(self.score_up_tones, self.score_down_tones)
+        self.do_prewarm(*[name.strip() for name in prewarm.split(",") if name.strip()])
+
+    def wake(self):
+        """Called from whichever thread has just queued an instruction: post
+        an event to wake the main loop unless one is already on its way.
+        """
+        if not self.wake_pending:
+            self.wake_pending = True
+            try:
+                pygame.event.post(pygame.event.Event(core.instruction_event_type))
+            except pygame.error:
+                core.log.exception("Unable to wake main loop")
+
+    def wait(self):
+        """Block until a pygame event arrives, an instruction is queued or
+        the next timer deadline passes and return any pending pygame events.
+        While a panel is animating, wake at least every 1 / max_fps seconds.
+        """
+        deadline = self.scheduler.next_deadline()
+        if self.max_fps and any(screen.is_animated for screen in self.panels.values()):
+            next_frame = self.last_frame + 1.0 / self.max_fps
+            deadline = next_frame if deadline is None else min(deadline, next_frame)
 
-    def check_pygame_events(self, objects):
-        """Pull all pygame events off the pygame queue and pass them to
-        the first object which will have them.
+        if deadline is None:
+            events = [pygame.event.wait()]
+        else:
+            delay_ms = int(math.ceil(1000 * (deadline - core.monotonic())))
+            if delay_ms > 0:
+                pygame.time.set_timer(core.deadline_event_type, delay_ms)
+                events = [pygame.event.wait()]
+                pygame.time.set_timer(core.deadline_event_type, 0)
+            else:
+                events = []
+        return events + pygame.event.get()
+
+    def check_pygame_events(self, objects, events=None):
+        """Pull all pygame events off the pygame queue (unless they have
+        already been pulled) and pass them to the first object which will
+        have them.
         """
-        for event in pygame.event.get():
+        if events is None:
+            events = pygame.event.get()
+        started = core.clock()
+        for event in events:
             for obj in objects:
                 if obj.handle_pygame_event(event):
                     break
-
-    def check_instructions(self, objects):
+        if events:
+            self.events_secs.add(core.clock() - started)
+
+    def build_dispatch(self):
+        """Build the table which maps each verb to the handler of the first
+        object which has one, the panels first and then the engine. This is
+        rebuilt whenever a panel switches screen, along with the tables used
+        to pass commands to one panel.
+        """
+        self.panel_dispatch = {}
+        for position, screen in self.panels.items():
+            self.panel_dispatch[position] = dict(
+                (verb, (getattr(screen, command.name), command))
+                    for verb, command in core.commands(screen.__class__).items()
+            )
+        self.dispatch = {}
+        for obj in reversed(self.panels.values() + [self]):
+            for verb, command in core.commands(obj.__class__).items():
+                self.dispatch[verb] = getattr(obj, command.name), command
+        engine_commands = core.commands(self.__class__)
+        for verb in self.engine_verbs:
+            self.dispatch[verb] = getattr(self, engine_commands[verb].name), engine_commands[verb]
+
+    def check_instructions(self):
         """Pull all instructions off the instruction queue and pass them to
         the first object which will have them. If the object's handler
         returns anything, push that back on the feedback queue.
         """
-        for action, args in self.instructions:
-            feedback = self.check_instruction(objects, action.strip().lower(), args)
-            if feedback:
-                self.publish(*feedback)
-
-    def check_instruction(self, objects, action, args):
-        """Find the first of a list of objects which can handle an action
-        and return whatever its handler returns. NB an action which ends
-        in a "?" invokes a get handler; any other action invokes a do handler.
+        self.wake_pending = False
+        instructions = list(self.instructions)
+        if instructions:
+            self.queue_depth.add(len(instructions))
+        if self.recorder and instructions:
+            #
+            # Losing the recording mustn't lose the instructions
+            #
+            try:
+                for action, args, queued_at in instructions:
+                    self.recorder.record(queued_at, action, args)
+                self.recorder.flush()
+            except (IOError, OSError):
+                core.log.exception("Unable to record instructions")
+        #
+        # The whole batch is off the queue now, so one instruction which
+        # fails mustn't lose those after it or the state they change.
+        #
+        try:
+            for action, args, queued_at in self.coalesce(instructions):
+                try:
+                    action = action.strip().lower()
+                    self.dispatch_latency_secs[action].add(core.clock() - queued_at)
+                    feedback = self.check_instruction(self.dispatch, action, args)
+                    if feedback:
+                        self.publish(*feedback)
+                except Exception:
+                    core.log.exception("Problem handling %s %s", action, args)
+        finally:
+            if instructions:
+                self.sync_state()
+
+    def coalesce_key(self, action, args, generations):
+        """Return what a coalescable instruction applies to, or None if it
+        must always be run. A REMOVE renumbers the teams, a NAME beyond the
+        last team adds teams and a SWITCH replaces a panel's screen, so
+        instructions either side of one are never coalesced: eg a SCORE for
+        a team must run after the NAME which created it. Arguments can be
+        numbers, byte strings or unicode, any of which may not be ASCII.
         """
-        if action.endswith("?"):
-            verb = "get_" + action[:-1]
-        else:
-            verb = "do_" + action
-
-        for obj in objects:
-            if hasattr(obj, verb):
-                return getattr(obj, verb) (*args)
+        if action == "name" and args:
+            try:
+                n_team = int(args[0])
+            except (ValueError, TypeError):
+                n_team = None
+            if n_team is not None and n_team >= generations["n_teams"]:
+                generations["n_teams"] = n_team + 1
+                generations["teams"] += 1
+                return None
+        if action in self.coalesced_verbs:
+            n_args = self.coalesced_verbs[action]
+            if len(args) >= n_args:
+                return (action, generations["teams"]) + tuple(("%s" % arg).strip() for arg in args[:n_args])
+        elif action in self.panel_positions and args:
+            verb = ("%s" % args[0]).strip().lower()
+            n_args = self.coalesced_panel_verbs.get(verb)
+            if n_args is not None and len(args) > n_args:
+                return (action, generations[action], verb) + tuple(("%s" % arg).strip() for arg in args[1:1 + n_args])
+        elif action == "remove":
+            generations["n_teams"] -= 1
+            generations["teams"] += 1
+        elif action == "switch" and args:
+            generations[("%s" % args[0]).lower()] += 1
+        return None
+
+    def coalesce(self, instructions):
+        """Drop any instruction in a batch which is superseded by a later one
+        to the same effect, eg a score for a team which is followed by
+        another score for the same team.
+        """
+        generations = collections.Counter(n_teams=len(self.teams))
+        keys = []
+        for action, args, queued_at in instructions:
+            try:
+                keys.append(self.coalesce_key(action.strip().lower(), args, generations))
+            except Exception:
+                #
+                # Leave it to fail, and be logged, when it's dispatched
+                #
+                keys.append(None)
+        latest = dict((key, n) for n, key in enumerate(keys) if key is not None)
+        coalesced = []
+        for n, (key, instruction) in enumerate(zip(keys, instructions)):
+            if key is None or latest[key] == n:
+                coalesced.append(instruction)
+            else:
+                #
+                # Count a panel's instructions by the verb passed to it
+                #
+                verb = key[2] if key[0] in self.panel_positions else key[0]
+                self.coalesced[verb] += 1
+        return coalesced
+
+    def check_instruction(self, dispatch, action, args):
+        """Look up an action in a dispatch table and return whatever its
+        handler returns. NB an action which ends in a "?" invokes a get
+        handler; any other action invokes a do handler.
+        """
+        try:
+            handler, command = dispatch[action]
+        except KeyError:
+            core.log.warn("No handler for %s", action)
+            return None
+
+        try:
+            args, kwargs = command.convert(args)
+        except ValueError:
+            core.log.warn("Invalid arguments for %s: %s", action, args)
+            return None
+        return handler(*args, **kwargs)
 
     def handle_pygame_event(self, event):
         """Handle core pygame events: quit & resize. For unhandled events,
@@ -122,6 +323,16 @@ class Engine(object):
         elif event.type == pygame.VIDEORESIZE:
             self.do_resize(event.size)
             return True
+        elif event.type == core.changed_event_type:
+            #
+            # Every panel has already seen this; nothing more to do
+            #
+            return True
+        elif event.type in (core.instruction_event_type, core.deadline_event_type):
+            #
+            # These only exist to wake the main loop
+            #
+            return True
         else:
             return False
 
@@ -131,39 +342,49 @@ class Engine(object):
         """
         if size:
             self.window_rect.size = size
-        self.window = pygame.display.set_mode(self.window_rect.size, self.window_flags)
+        if self.headless:
+            self.window = pygame.Surface(self.window_rect.size, 0, 32)
+        else:
+            self.window = pygame.display.set_mode(self.window_rect.size, self.window_flags)
         self.panel_rects = dict()
         w, h = self.window_rect.size
         for position, (pleft, ptop, pwidth, pheight) in self.panel_positions.items():
             self.panel_rects[position] = core.Rect(w * pleft, h * ptop, w * pwidth, h * pheight).inflate(-4, -4)
         self.repaint()
 
+    @core.coerce(n_team=int)
     def do_name(self, n_team, name):
         """Set the name for a team(this is often done incrementally from
         the controller, so the name is likely to be a part name
         """
-        for i in range(1 + n_team - len(self.teams)):
-            self.teams.append(Team(""))
+        if n_team >= len(self.teams):
+            for i in range(1 + n_team - len(self.teams)):
+                self.teams.append(Team(""))
+            self.notify("teams")
+        core.texts.discard(self.teams[n_team].name)
         self.teams[n_team].name = name
+        self.notify("names", n_team=n_team)
 
+    @core.coerce(n_team=int)
     def do_remove(self, n_team):
         """Remove a team from the scoreboard
         """
-        self.teams = self.teams[:n_team] + self.teams[n_team:]
+        core.texts.discard(self.teams[n_team].name)
+        self.teams = self.teams[:n_team] + self.teams[n_team + 1:]
+        self.notify("teams")
 
+    @core.coerce(which_team=int, value=int)
     def do_score(self, which_team, value):
         """Set the score for a team.
         """
-        team = self.teams[int(which_team)]
+        team = self.teams[which_team]
         score0 = team.score
         team.score = value
         if team.score > score0:
-            beep(1440, 100)
-            beep(2880, 200)
+            self.audio.beep(*self.score_up_tones)
         elif team.score < score0:
-            beep(440, 100)
-            beep(220, 200)
-        pygame.event.post(core.scores_changed_event)
+            self.audio.beep(*self.score_down_tones)
+        self.notify("scores", n_team=which_team)
 
     def do_quit(self):
         self.publish("QUIT")
@@ -175,9 +396,17 @@ class Engine(object):
         """
         position = position.lower()
         assert position in self.panel_positions
-        cls = screens._screens[screen_name.lower()]
+        cls = screen.registry.get(screen_name)
         if self.panels[position].name != screen_name:
+            self.panels[position].close()
             self.panels[position] = cls(self)
+            self.build_dispatch()
+
+    def do_prewarm(self, *screen_names):
+        """Import screens in the background ready to be switched to
+        """
+        if screen_names:
+            screen.registry.prewarm(*screen_names)
 
     def _do_position(self, position, *args):
         """Send a command to the left or right panel. NB This
@@ -188,7 +417,7 @@ class Engine(object):
         if screen:
             action, args = args[0], args[1:]
             core.log.debug("Passing %s: %s onto %s", action, args, screen)
-            feedback = self.check_instruction([screen], action.strip().lower(), args)
+            feedback = self.check_instruction(self.panel_dispatch[position], action.strip().lower(), args)
             if feedback:
                 self.publish(position, *feedback)
 
@@ -207,16 +436,11 @@ class Engine(object):
         return a list of valid commands
         """
         if command:
-            fn = getattr(self, ("get_" if command.endswith("?") else "do_") + command.lower(), None)
-            if fn:
-                args = inspect.getargspec(fn).args[1:]
-                return "HELP", command.upper(), args
+            if command.lower() in self.dispatch:
+                handler, info = self.dispatch[command.lower()]
+                return "HELP", command.upper(), info.args
         else:
-            commands = set()
-            for obj in [self] + self.panels.values():
-                commands.update(i[len("do_"):] for i in dir(obj) if i.startswith("do_"))
-                commands.update(i[len("get_"):] + "?" for i in dir(obj) if i.startswith("get_"))
-            return "HELP", sorted(commands)
+            return "HELP", sorted(self.dispatch)
 
     #~ def get_positions(self):
         #~ """Return a list of position names(typically "left" and "right")
@@ -232,6 +456,77 @@ class Engine(object):
         #~ core.log.debug("Panels: %s", self.panels)
         #~ return "POSITION", position, self.panels[position.lower()].name
 
+    def get_stats(self):
+        """Return counters describing the engine's work so far, along with
+        recent timings: how long each panel takes to render, how long pygame
+        events take to handle, how deep the instruction queue gets, how long
+        each command waits to be dispatched and how long feedback takes to
+        publish and to reach the controllers.
+        """
+        def summarise(histograms):
+            return dict((name, histogram.stats()) for name, histogram in histograms.items())
+        return "STATS", {
+            "coalesced" : dict(self.coalesced),
+            "ready_secs" : self.ready_secs,
+            "feedback" : self.feedback.stats(),
+            "render_secs" : summarise(self.render_secs),
+            "frame_secs" : self.frame_secs.stats(),
+            "events_secs" : self.events_secs.stats(),
+            "queue_depth" : self.queue_depth.stats(),
+            "dispatch_latency_secs" : summarise(self.dispatch_latency_secs),
+            "publish_secs" : self.publish_secs.stats(),
+            "delivery_secs" : self.feedback.delivery_stats(),
+            "fonts" : core.fonts.stats(),
+            "texts" : core.texts.stats(),
+        }
+
+    def snapshot(self):
+        """Return everything a controller might show as a flat dictionary:
+        each team's name, score and colour and each panel's screen, style
+        and other state.
+        """
+        snapshot = {"teams" : len(self.teams)}
+        for n_team, team in enumerate(self.teams):
+            snapshot["team.%d.name" % n_team] = team.name
+            snapshot["team.%d.score" % n_team] = team.score
+            snapshot["team.%d.colour" % n_team] = "#%02x%02x%02x" % team.colour[:3]
+        for position, screen in self.panels.items():
+            snapshot["%s.screen" % position] = screen.name
+            for field in screen._state:
+                snapshot["%s.%s" % (position, field)] = getattr(screen, field, None)
+        return snapshot
+
+    def sync_state(self):
+        """Bring the versioned state up to date and, if anything changed,
+        push the changes to every controller as a DELTA.
+        """
+        changed = self.state.update(self.snapshot())
+        if changed:
+            self.publish("DELTA", {
+                "epoch" : self.state.epoch,
+                "since" : self.state.version - 1,
+                "version" : self.state.version,
+                "changes" : dict((key, self.state.values[key]) for key in changed),
+            })
+
+    @core.keywords
+    def get_state(self, since=0, epoch=None):
+        """Return what has changed since version `since`, or everything if
+        `epoch` isn't the current one, eg STATE? since=12 epoch=15f3a2c
+        """
+        self.sync_state()
+        is_full = epoch != self.state.epoch or since > self.state.version
+        changes = self.state.since(0 if is_full else since)
+        if is_full:
+            changes = dict((key, value) for key, value in changes.items() if value is not None)
+        return "STATE", {
+            "epoch" : self.state.epoch,
+            "since" : 0 if is_full else since,
+            "version" : self.state.version,
+            "full" : is_full,
+            "changes" : changes,
+        }
+
     def get_teams(self):
         """Return a list of teams
         """
@@ -251,29 +546,80 @@ class Engine(object):
         """Completely repaint the screen,
         """
         self.window.fill(self.background_colour)
+        self.needs_flip = True
         for position, screen in self.panels.items():
             #
             # FIXME: is_dirty is probably redundant
             #
             screen.is_dirty = True
 
+    def notify(self, what, **kwargs):
+        """Let every panel know that something it might display has changed;
+        see core.changed_event.
+        """
+        #
+        # Hand the change straight to each panel rather than posting it:
+        # a batch of instructions can change far more than SDL's event
+        # queue will hold.
+        #
+        event = core.changed_event(what, **kwargs)
+        for screen in self.panels.values():
+            screen.handle_change(event)
+
     def publish(self, message, *args):
-        """Send a message and parameters back through the feedback queue
+        """Send a message and parameters to every controller's feedback queue
         """
         core.log.debug("Publish %s: %s", message, args)
+        started = core.clock()
         self.feedback.put(message, *args)
+        self.publish_secs.add(core.clock() - started)
+
+    def render(self):
+        """Render each panel and push to the display only the rects which
+        were redrawn; if nothing was, don't touch the display at all.
+        """
+        started = core.clock()
+        rects = []
+        for position, screen in self.panels.items():
+            screen_started = core.clock()
+            screen_rects = screen.render(self.window, self.panel_rects[position])
+            if screen_rects:
+                self.render_secs[position].add(core.clock() - screen_started)
+                rects.extend(screen_rects)
+        self.last_frame = core.monotonic()
+        if not (rects or self.needs_flip):
+            return
+
+        if self.frame_dirpath:
+            self.n_frame += 1
+            pygame.image.save(self.window, os.path.join(self.frame_dirpath, "frame-%06d.png" % self.n_frame))
+        if self.headless:
+            pass
+        elif self.needs_flip:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        self.needs_flip = False
+        self.frame_secs.add(core.clock() - started)
 
     def run(self):
         #
-        # Set up two Pyro-linked queues: one for instructions; the other
-        # for feedback from the instruction handlers.
+        # Serve the two queues over each transport: one for instructions;
+        # the other for feedback from the instruction handlers.
+        #
+        # Anything sent before the main loop starts waits on the queue.
         #
-        instruction_manager = threading.Thread(
-            target=manage_instructions,
-            args=(self.instructions, self.feedback)
-        )
-        instruction_manager.daemon = True
-        instruction_manager.start()
+        started = core.clock()
+        transports_ready = []
+        for instruction_transport in self.transports:
+            ready = threading.Event()
+            instruction_manager = threading.Thread(
+                target=self.serve,
+                args=(instruction_transport, ready)
+            )
+            instruction_manager.daemon = True
+            instruction_manager.start()
+            transports_ready.append((instruction_transport.name, instruction_manager, ready))
 
         #
         # Reset the screen to its default size and caption
@@ -282,24 +628,61 @@ class Engine(object):
         pygame.display.set_caption("Westpark Quiz")
 
         #
-        # At no more than 5 frames a second, render all current panels
-        # and check for incoming instructions or pygame events.
+        # Only say we're ready once every transport is listening. If one
+        # can't listen, eg because another engine already has its port,
+        # give up rather than run where no controller can reach us.
         #
-        clock = pygame.time.Clock()
+        deadline = started + self.ready_timeout_secs
+        for name, instruction_manager, ready in transports_ready:
+            while not ready.is_set() and instruction_manager.is_alive() and core.clock() < deadline:
+                ready.wait(0.05)
+            if not ready.is_set():
+                core.log.error("The %s transport isn't ready after %.3fs", name, core.clock() - started)
+                sys.exit(1)
+            self.ready_secs[name] = core.clock() - started
+        core.log.info("Engine ready: %s", ", ".join("%s in %.3fs" % item for item in sorted(self.ready_secs.items())))
+        self.ready.set()
+
         while True:
-            for position, screen in self.panels.items():
-                screen.render(self.window, self.panel_rects[position])
-            pygame.display.flip()
-            clock.tick(5)
+            self.step()
 
-            objects = self.panels.values() + [self]
-            try:
-                self.check_pygame_events(objects)
-                self.check_instructions(objects)
-            except Exception, err:
-                core.log.exception("Problem in main loop")
-                # core.log errors and then ignore them in an attempt
-                # not to crash out midstream
+    def serve(self, instruction_transport, ready):
+        """Serve the instruction queue and feedback hub over one transport
+        until the engine stops, logging whatever stops it sooner.
+        """
+        try:
+            instruction_transport.serve(self.instructions, self.feedback, ready)
+        except Exception:
+            core.log.exception("The %s transport failed", instruction_transport.name)
+
+    def step(self):
+        """Render whatever has changed then sleep until there's something
+        to do: a pygame event, an incoming instruction or a timer.
+        """
+        self.render()
+        events = self.wait()
+
+        objects = self.panels.values() + [self]
+        try:
+            self.check_pygame_events(objects, events)
+            self.check_instructions()
+            self.scheduler.run_due()
+        except Exception, err:
+            core.log.exception("Problem in main loop")
+            # core.log errors and then ignore them in an attempt
+            # not to crash out midstream
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Run the quiz display engine")
+    parser.add_argument("--transports", default="pyro", help="comma-separated: %s" % ", ".join(sorted(transport.transports)))
+    parser.add_argument("--headless", action="store_true", help="render offscreen without a display")
+    parser.add_argument("--silent", action="store_true", help="play no sounds")
+    parser.add_argument("--frames", dest="frame_dirpath", help="save each changed frame to this directory as PNG")
+    parser.add_argument("--record", dest="record_filepath", help="record every instruction received to this file")
+    parser.add_argument("--plugins", dest="plugins_dirpath", help="a directory of extra screens (default: %s)" % Engine.plugins_dirpath)
+    parser.add_argument("--prewarm", default="", help="comma-separated screens to load in the background at startup")
+    options = parser.parse_args(args)
+    Engine(**vars(options)).run()
 
 if __name__ == '__main__':
-    Engine(*sys.argv[1:]).run()
+    main(sys.argv[1:])
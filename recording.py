@@ -0,0 +1,70 @@
+"""Record the instructions an engine receives, with the time each was
+queued, so that a busy evening can be replayed later; see replay.py.
+Times come from core.clock, which doesn't jump when the wall clock is
+corrected, so a gap in the recording is always a real one.
+
+A recording starts with a short signature line. Each instruction then
+follows as the microseconds since the one before it and the length of
+its wire-encoded message, both as varints, followed by the message.
+"""
+import core
+import wire
+
+signature = "QUIZ-RECORDING 1\n"
+
+class Recorder(object):
+
+    def __init__(self, filepath):
+        self.f = open(filepath, "wb")
+        self.f.write(signature)
+        self.last_at = None
+
+    def record(self, queued_at, action, args):
+        """Append one instruction; one which can't be encoded is logged and
+        left out rather than stopping the engine from running it.
+        """
+        try:
+            data = wire.encode(action, args)
+        except (wire.EncodingError, ValueError, TypeError, AttributeError):
+            core.log.exception("Unable to record %s %s", action, args)
+            return
+
+        #
+        # Instructions from different threads can be queued very slightly
+        # out of order; never let the time run backwards.
+        #
+        if self.last_at is None:
+            self.last_at = queued_at
+        gap_usecs = max(0, int(round(1000000 * (queued_at - self.last_at))))
+        self.last_at = max(self.last_at, queued_at)
+
+        out = bytearray()
+        wire.write_varint(out, gap_usecs)
+        wire.write_varint(out, len(data))
+        out.extend(data)
+        self.f.write(out)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+def read(filepath):
+    """Generate (secs, action, args) for each instruction in a recording,
+    where secs is the time since the first instruction was queued.
+    """
+    with open(filepath, "rb") as f:
+        if f.readline() != signature:
+            raise ValueError("%s is not a recording" % filepath)
+        data = bytearray(f.read())
+
+    pos = 0
+    usecs = 0
+    while pos < len(data):
+        gap_usecs, pos = wire.read_varint(data, pos)
+        length, pos = wire.read_varint(data, pos)
+        usecs += gap_usecs
+        action, args = wire.decode(data[pos:pos + length])
+        pos += length
+        yield usecs / 1000000.0, action, args
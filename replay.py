@@ -0,0 +1,87 @@
+#!python2
+"""Play a recording made by `quiz.py --record` into a headless engine and
+report how quickly the engine kept up, eg:
+
+    python replay.py evening.rec --speed 10
+"""
+import os, sys
+import argparse
+import itertools
+import threading
+import time
+
+import core
+import quiz
+import recording
+
+def feed(engine, filepath, speed, finished):
+    """Put each recorded instruction onto the engine's queue at `speed`
+    times the rate at which it was recorded, or as fast as possible if
+    `speed` is None. A recorded QUIT is skipped so the replay runs to the
+    end of the recording.
+    """
+    started = core.clock()
+    for secs, action, args in recording.read(filepath):
+        if action.strip().lower() == "quit":
+            continue
+        if speed:
+            delay = started + secs / speed - core.clock()
+            if delay > 0:
+                time.sleep(delay)
+        engine.instructions.put(action, *args)
+    finished.set()
+    engine.wake()
+
+def replay(filepath, speed=1.0, frame_dirpath=None):
+    """Replay a recording into a fresh headless, silent engine and return
+    its STATS once every instruction has been dispatched, along with the
+    number of instructions and how long they took.
+    """
+    engine = quiz.Engine(transports="", headless=True, silent=True, frame_dirpath=frame_dirpath)
+    engine.do_resize()
+    finished = threading.Event()
+    feeder = threading.Thread(target=feed, args=(engine, filepath, speed, finished))
+    feeder.daemon = True
+
+    started = core.clock()
+    feeder.start()
+    while not (finished.is_set() and engine.instructions.empty()):
+        engine.step()
+    elapsed_secs = core.clock() - started
+
+    message, stats = engine.get_stats()
+    stats["n_instructions"] = sum(histogram.n_samples for histogram in engine.dispatch_latency_secs.values()) + sum(engine.coalesced.values())
+    stats["elapsed_secs"] = elapsed_secs
+    stats["latency_secs"] = _merged(engine.dispatch_latency_secs.values())
+    return stats
+
+def _merged(histograms):
+    merged = core.Histogram(size=None)
+    for sample in itertools.chain(*(histogram.samples for histogram in histograms)):
+        merged.add(sample)
+    return merged.stats()
+
+def report(stats, speed):
+    print "Replayed %d instructions at %s in %.2fs: %.0f instructions/s" % (
+        stats["n_instructions"], "%gx" % speed if speed else "max speed",
+        stats["elapsed_secs"], stats["n_instructions"] / max(stats["elapsed_secs"], 1e-6)
+    )
+    for name in "latency_secs", "frame_secs", "events_secs":
+        if stats[name]["count"]:
+            print "  %-14s p50 %7.2fms  p99 %7.2fms  max %7.2fms" % (
+                name, 1000 * stats[name]["p50"], 1000 * stats[name]["p99"], 1000 * stats[name]["max"]
+            )
+    if stats["queue_depth"]["count"]:
+        print "  %-14s p50 %7d    p99 %7d    max %7d" % ("queue_depth", stats["queue_depth"]["p50"], stats["queue_depth"]["p99"], stats["queue_depth"]["max"])
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Replay a recording into a headless engine")
+    parser.add_argument("filepath")
+    parser.add_argument("--speed", default="1", help="a multiple of the recorded rate, or max")
+    parser.add_argument("--frames", dest="frame_dirpath", help="save each changed frame to this directory as PNG")
+    options = parser.parse_args(args)
+    speed = None if options.speed == "max" else float(options.speed)
+    report(replay(options.filepath, speed, options.frame_dirpath), speed)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
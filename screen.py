@@ -1,7 +1,10 @@
 import os, sys
+import glob
+import imp
+import importlib
 import shlex
+import threading
 
-from PyQt4 import QtCore, QtGui
 import pygame
 
 import core
@@ -12,6 +15,14 @@ class Screen(object):
     _state = ["style"]
 
     KEYS = {}
+    #
+    # Engine changes (see Engine.notify) which mean this screen must redraw
+    #
+    depends_on = set()
+    #
+    # An animated screen is rendered at the engine's max_fps
+    #
+    is_animated = False
 
     background_colour = core.Color.dark
     foreground_colour = core.Color.light
@@ -21,19 +32,35 @@ class Screen(object):
     def __init__(self, engine, style="default"):
         self.engine = engine
         self.is_dirty = True
+        self.changes = set()
         self.style = None
         self.do_style(style)
 
     def handle_pygame_event(self, event):
         """Generic screen handler for pygame events which looks in a keys
         dictionary to find a mapping between a pygame key and an instruction.
+        Change notifications are never consumed so every panel sees them.
         """
-        if event.type == pygame.KEYDOWN and event.key in self.KEYS:
-            self.engine.instructions.put(KEYS[event.key])
+        if event.type == core.changed_event_type:
+            self.handle_change(event)
+            return False
+        elif event.type == pygame.KEYDOWN and event.key in self.KEYS:
+            self.engine.instructions.put(self.KEYS[event.key])
             return True
         else:
             return False
 
+    def close(self):
+        """Called when the screen is switched out of its panel
+        """
+        pass
+
+    def handle_change(self, event):
+        """Mark the screen for redrawing if it depends on what has changed
+        """
+        if event.what in self.depends_on:
+            self.is_dirty = True
+
     #
     # Default actions
     #
@@ -73,64 +100,146 @@ class Screen(object):
         raise NotImplemented
 
     def render(self, surface, rect):
+        """Draw whatever needs drawing and return a list of the rects touched
+        so the engine can update only those parts of the display.
+
+        A dirty screen is redrawn completely. Otherwise any changes noted
+        since the last frame are passed to an update_<style> method, if the
+        screen has one, which returns the rects it has redrawn or None if it
+        can't manage a partial redraw.
+
+        Drawing is clipped to the panel so that nothing, eg a greeting
+        wider than the panel, spills over onto its neighbour.
+        """
+        clip = surface.get_clip()
+        surface.set_clip(rect)
+        try:
+            return [pygame.Rect(touched).clip(rect) for touched in self._render(surface, rect)]
+        finally:
+            surface.set_clip(clip)
+
+    def _render(self, surface, rect):
+        if self.changes and not self.is_dirty:
+            changes, self.changes = self.changes, set()
+            updater = getattr(self, "update_" + self.style, None)
+            rects = updater(surface, rect.inflate(-8, -8), changes) if updater else None
+            if rects is not None:
+                return rects
+            self.is_dirty = True
+
         if self.is_dirty:
             surface.fill(self.background_colour, rect)
             self.renderer(surface, rect.inflate(-8, -8))
             self.is_dirty = False
-
-class ScreenWidget(QtGui.QWidget):
-
-    name = ""
-    screen = Screen
-
-    def __init__(self, controller, position, *args, **kwargs):
-        super(ScreenWidget, self).__init__(*args, **kwargs)
-        self.controller = controller
-        self.position = position.lower()
-
-        overall_layout = QtGui.QVBoxLayout()
-        layout = QtGui.QHBoxLayout()
-        layout.addWidget(QtGui.QLabel ("Style"))
-        self.styles = QtGui.QComboBox()
-        self.styles.addItems(self.screen._styles())
-        layout.addWidget(self.styles)
-        overall_layout.addLayout(layout)
-
-        widget_layout = self.widgets()
-        if widget_layout:
-            overall_layout.addLayout(widget_layout)
-
-        layout = QtGui.QHBoxLayout()
-        self.apply = QtGui.QPushButton("Apply")
-        layout.addWidget(self.apply)
-        overall_layout.addLayout(layout)
-
-        self.setLayout(overall_layout)
-
-        self.styles.currentIndexChanged.connect(self.on_style)
-        self.apply.clicked.connect(self.on_apply)
-
-    def widgets(self):
-        """Set up some widgets; return a layout
+            self.changes.clear()
+            return [rect]
+        else:
+            return []
+
+class Registry(object):
+    """Screens by name, each declared as where to find it and imported only
+    when it's first needed. A screen can be declared as "module:Class", as
+    the path to a plugin file which defines one Screen subclass, or as a
+    setuptools entry point in the "quiz.screens" group.
+    """
+
+    entry_point_group = "quiz.screens"
+
+    def __init__(self):
+        self.declared = {}
+        self.loaded = {}
+        self.loading = {}
+        self.lock = threading.RLock()
+        self.has_entry_points = False
+
+    def declare(self, name, target):
+        self.declared[name.lower()] = target
+
+    def discover(self, plugins_dirpath):
+        """Declare a screen for each .py file in `plugins_dirpath`, named
+        for the file.
         """
-        return None
-
-    def send_command(self, *args):
-        self.controller.send_command(self.position.upper(), *args)
-
-    def on_style(self, index):
-        core.log.debug("Handling style change for position %s, style %s", self.position, index)
-        core.log.debug(self.styles.itemText (index))
-        self.send_command("style", unicode(self.styles.currentText ()).encode("iso-8859-1"))
-
-    def on_apply(self):
-        raise NotImplementedError
-
-    def handle_reset(self, params):
-        if "style" in params:
-            style = params.pop("style")
-        for field, value in params.items ():
+        for filepath in glob.glob(os.path.join(plugins_dirpath, "*.py")):
+            name, ext = os.path.splitext(os.path.basename(filepath))
+            if not name.startswith("_"):
+                self.declare(name, filepath)
+
+    def discover_entry_points(self):
+        """Declare a screen for each entry point installed in our group.
+        This is put off until a screen is asked for which hasn't otherwise
+        been declared as pkg_resources itself is slow to import.
+        """
+        with self.lock:
+            if self.has_entry_points:
+                return
+            self.has_entry_points = True
+            try:
+                import pkg_resources
+            except ImportError:
+                return
+            for entry_point in pkg_resources.iter_entry_points(self.entry_point_group):
+                self.declared.setdefault(entry_point.name.lower(), entry_point)
+
+    def names(self):
+        self.discover_entry_points()
+        return sorted(self.declared)
+
+    def get(self, name):
+        """Return the Screen class declared as `name`, importing it if this
+        is the first time it's been asked for. Raises KeyError if no screen
+        of that name has been declared.
+
+        A screen which has already been loaded is returned without taking
+        any lock, and each screen is imported under a lock of its own, so
+        prewarming a slow screen never holds up switching to another.
+        """
+        name = name.lower()
+        try:
+            return self.loaded[name]
+        except KeyError:
             pass
+        if name not in self.declared:
+            self.discover_entry_points()
+        target = self.declared[name]
+        with self.lock:
+            loading = self.loading.setdefault(name, threading.Lock())
+        with loading:
+            if name not in self.loaded:
+                self.loaded[name] = self._load(target)
+            return self.loaded[name]
+
+    def _load(self, target):
+        if hasattr(target, "load"):
+            return target.load()
+        elif target.endswith(".py"):
+            module_name = "quiz_plugin_" + os.path.splitext(os.path.basename(target))[0]
+            module = imp.load_source(module_name, target)
+            for obj in vars(module).values():
+                if isinstance(obj, type) and issubclass(obj, Screen) and obj.__module__ == module_name:
+                    return obj
+            raise ImportError("No screen defined in %s" % target)
+        else:
+            module_name, class_name = target.split(":")
+            return getattr(importlib.import_module(module_name), class_name)
 
-    def handle_default(self):
-        raise NotImplementedError
+    def prewarm(self, *names):
+        """Import screens in the background so that switching to one of
+        them later doesn't stall the display while it loads.
+        """
+        thread = threading.Thread(target=self._prewarm, args=names)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _prewarm(self, *names):
+        for name in names:
+            try:
+                self.get(name)
+            except Exception:
+                core.log.exception("Unable to prewarm screen %s", name)
+
+registry = Registry()
+registry.declare("Blank", "screens:Blank")
+registry.declare("Splash", "screens:Splash")
+registry.declare("Countdown", "screens:Countdown")
+registry.declare("Scores", "screens:Scores")
@@ -1,14 +1,6 @@
 import math
-try:
-    import winsound
-    def beep(frequency, duration):
-        winsound.Beep(frequency, duration)
-except ImportError:
-    def beep(frequency, duration):
-        pass
 
 import pygame
-from PyQt4 import QtCore, QtGui
 
 import core
 import screen
@@ -20,13 +12,8 @@ class Blank(screen.Screen):
     def render_default(self, surface, rect):
         pass
 
-class BlankWidget(screen.ScreenWidget):
-
-    screen = Blank
-    name = screen.name
-
 #
-# Splash - screen & widget
+# Splash
 #
 class Splash(screen.Screen):
 
@@ -39,32 +26,26 @@ class Splash(screen.Screen):
 
     def do_reset(self, greetings):
         self.greetings = greetings
-        self.is_dirty = True
+        self.changes.add("greetings")
 
     def render_default(self, surface, rect):
         surface.fill(self.background_colour, rect)
-        text = core.Font(self.typeface, rect.height / 10).render(self.greetings, self.foreground_colour)
-        text_rect = text.get_rect()
-        text_rect.center = rect.center
-        surface.blit(text, text_rect)
-
-class SplashWidget(screen.ScreenWidget):
-
-    screen = Splash
-    name = screen.name
-
-    def widgets(self):
-        layout = QtGui.QHBoxLayout()
-        self.greetings = QtGui.QLineEdit("Quizzicals")
-        self.greetings.textEdited.connect(self.on_greetings)
-        layout.addWidget(self.greetings)
-        return layout
-
-    def on_greetings(self, new_greetings):
-        self.send_command("reset", new_greetings)
+        text = core.texts.render(core.get_font(self.typeface, rect.height / 10), self.greetings, self.foreground_colour)
+        self.text_rect = text.get_rect()
+        self.text_rect.center = rect.center
+        surface.blit(text, self.text_rect)
+
+    def update_default(self, surface, rect, changes):
+        old_text_rect = self.text_rect
+        surface.fill(self.background_colour, old_text_rect)
+        text = core.texts.render(core.get_font(self.typeface, rect.height / 10), self.greetings, self.foreground_colour)
+        self.text_rect = text.get_rect()
+        self.text_rect.center = rect.center
+        surface.blit(text, self.text_rect)
+        return [old_text_rect, self.text_rect]
 
 #
-# Countdown - screen & widget
+# Countdown
 #
 class Countdown(screen.Screen):
 
@@ -90,56 +71,174 @@ class Countdown(screen.Screen):
 
     def __init__(self, engine, style="default", n_ticks=60, big_tick_every_n=5, tick_interval_secs=1, final_furlong=None):
         super(Countdown, self).__init__(engine)
+        self.timer = None
         self.do_reset(n_ticks, big_tick_every_n, tick_interval_secs, final_furlong)
 
-    def handle_pygame_event(self, event):
-        if event.type == core.timer_event_type:
-            self.engine.instructions.put("TICK")
-            return True
-        else:
-            return super(Countdown, self).handle_pygame_event(event)
+    def close(self):
+        self.cancel_timer()
+
+    def cancel_timer(self):
+        if self.timer:
+            self.engine.scheduler.cancel(self.timer)
+            self.timer = None
+
+    def schedule_tick(self):
+        """Ask the engine to wake us at the next deadline on the timeline
+        """
+        self.cancel_timer()
+        deadline = self.timeline.next_deadline()
+        if deadline is not None:
+            self.timer = self.engine.scheduler.call_at(deadline, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        for n in range(self.timeline.due()):
+            self.do_tick()
+        self.schedule_tick()
 
     def render_countdown(self, surface, rect):
+        if self.n_tick > self.n_ticks:
+            return
         tick_type = self.ticks[self.n_tick]
         if tick_type is not None:
-            colours = self.final_colours if self.n_tick > self.n_ticks - self.final_furlong else self.colours
-            font = core.Font(self.typeface, rect.height / self.font_quotients[tick_type])
-            text = font.render("%d" % (self.n_ticks - self.n_tick), colours[tick_type])
+            font = core.get_font(self.typeface, rect.height / self.font_quotients[tick_type])
+            text = core.texts.render(font, "%d" % (self.n_ticks - self.n_tick), self._tick_colour(self.n_tick))
             text_rect = text.get_rect()
             text_rect.center = rect.center
             surface.blit(text, text_rect)
 
-    def render_vbars(self, surface, rect):
-        tick_w = rect.width / 5
-        tick_h = rect.height / self.n_ticks
-        for n_tick, tick in enumerate(self.ticks):
-            if tick is None: continue
-            colours = self.final_colours if n_tick > self.n_ticks - self.final_furlong else self.colours
+    def update_countdown(self, surface, rect, changes):
+        surface.fill(self.background_colour, rect)
+        self.render_countdown(surface, rect)
+        return [rect]
+
+    def _tick_colour(self, n_tick):
+        colours = self.final_colours if n_tick > self.n_ticks - self.final_furlong else self.colours
+        return colours[self.tick_types[n_tick]]
+
+    def _geometry(self, style, size, calculate):
+        """Return the positions of every tick for this style, relative to the
+        panel, calculating them only when the panel size has changed since
+        the last call or the countdown has been reset.
+        """
+        if style not in self.geometry or self.geometry[style][0] != size:
+            self.geometry[style] = size, calculate(size)
+        return self.geometry[style][1]
+
+    def _dial(self, style, surface, size, draw):
+        """Return a surface showing every tick for this style, drawn once
+        per reset or change of panel size, in the same format as `surface`.
+        """
+        if style not in self.dials or self.dials[style][0] != size:
+            dial = pygame.Surface(size, 0, surface)
+            dial.fill(self.background_colour)
+            draw(dial)
+            self.dials[style] = size, dial
+        return self.dials[style][1]
+
+    def _render_dial(self, style, surface, rect, draw, erase):
+        """Blit the whole dial and erase the ticks which have gone; this only
+        happens on a full redraw. Each tick thereafter erases just its own.
+        """
+        surface.blit(self._dial(style, surface, rect.size, draw), rect)
+        for n_tick in range(1, self.n_tick):
+            erase(surface, rect, n_tick)
+
+    def _erase_tick(self, surface, rect, n_tick, bounds, draw_tick):
+        """Blank the area a tick covers, then redraw within it whichever ticks
+        still showing overlap it, so that erasing one tick never takes a bite
+        out of its neighbours. Return the rect touched.
+        """
+        erased = bounds[n_tick].move(rect.topleft)
+        surface.fill(self.background_colour, erased)
+        clip = surface.get_clip()
+        surface.set_clip(erased.clip(clip))
+        for n in range(1, self.n_ticks + 1):
+            if self.ticks[n] is not None and bounds[n].colliderect(bounds[n_tick]):
+                draw_tick(surface, rect, n)
+        surface.set_clip(clip)
+        return erased
+
+    def _vbar_rects(self, size):
+        width, height = size
+        tick_w = width / 5
+        tick_h = height / self.n_ticks
+        rects = [None]
+        for n_tick in range(1, self.n_ticks + 1):
             tick_rect = core.Rect(0, 0, tick_w, tick_h).inflate(-4, -4)
-            tick_rect.top = rect.top + tick_h * n_tick
-            tick_rect.centerx = rect.centerx
-            surface.fill(colours[tick], tick_rect)
+            tick_rect.top = tick_h * n_tick
+            tick_rect.centerx = width / 2
+            rects.append(tick_rect)
+        return rects
 
-    def render_clock(self, surface, rect):
+    def _draw_vbar(self, surface, rect, n_tick):
+        tick_rect = self._geometry("vbars", rect.size, self._vbar_rects)[n_tick]
+        surface.fill(self._tick_colour(n_tick), tick_rect.move(rect.topleft))
+
+    def _draw_vbars(self, dial):
+        for n_tick in range(1, self.n_ticks + 1):
+            self._draw_vbar(dial, dial.get_rect(), n_tick)
+
+    def _erase_vbar(self, surface, rect, n_tick):
+        return self._erase_tick(surface, rect, n_tick, self._geometry("vbars", rect.size, self._vbar_rects), self._draw_vbar)
+
+    def render_vbars(self, surface, rect):
+        self._render_dial("vbars", surface, rect, self._draw_vbars, self._erase_vbar)
+
+    def update_vbars(self, surface, rect, changes):
+        return [self._erase_vbar(surface, rect, n_tick) for n_tick in changes]
+
+    def _clock_discs(self, size):
+        """Return the centre and radius of every tick's disc on the clock
+        """
+        width, height = size
         disc_size = {
             "big" : int(10 * 60.0 / self.n_ticks),
             "little" : int(8 * 60.0 / self.n_ticks)
         }
-        radius = (min(rect.height, rect.width) - 100) / 2
+        radius = (min(height, width) - 100) / 2
         half_pi = math.pi / 2.0
         radian_gap = 2.0 * math.pi / self.n_ticks
 
-        for n_tick, tick in enumerate(self.ticks):
-            if tick is None: continue
+        discs = [None]
+        for n_tick in range(1, self.n_ticks + 1):
             n = (radian_gap * n_tick) - half_pi
             x = int(math.cos(n) * radius)
             y = int(math.sin(n) * radius)
-            colours = self.final_colours if n_tick > self.n_ticks - self.final_furlong else self.colours
-            pygame.draw.circle(surface, colours[tick], (rect.centerx + x, rect.centery + y), disc_size[tick])
+            discs.append(((width / 2 + x, height / 2 + y), disc_size[self.tick_types[n_tick]]))
+        return discs
+
+    def _clock_bounds(self, size):
+        """Return a rect around each of the clock's discs, a pixel larger
+        all round than any disc pygame draws
+        """
+        return [None] + [
+            core.Rect(x - disc_size - 1, y - disc_size - 1, 2 * disc_size + 3, 2 * disc_size + 3)
+                for (x, y), disc_size in self._geometry("clock", size, self._clock_discs)[1:]
+        ]
+
+    def _draw_clock_disc(self, surface, rect, n_tick):
+        (x, y), disc_size = self._geometry("clock", rect.size, self._clock_discs)[n_tick]
+        pygame.draw.circle(surface, self._tick_colour(n_tick), (rect.left + x, rect.top + y), disc_size)
+
+    def _draw_clock(self, dial):
+        for n_tick in range(1, self.n_ticks + 1):
+            self._draw_clock_disc(dial, dial.get_rect(), n_tick)
+
+    def _erase_clock_disc(self, surface, rect, n_tick):
+        return self._erase_tick(surface, rect, n_tick, self._geometry("clock bounds", rect.size, self._clock_bounds), self._draw_clock_disc)
+
+    def render_clock(self, surface, rect):
+        self._render_dial("clock", surface, rect, self._draw_clock, self._erase_clock_disc)
+
+    def update_clock(self, surface, rect, changes):
+        return [self._erase_clock_disc(surface, rect, n_tick) for n_tick in changes]
 
     render_default = render_clock
+    update_default = update_clock
 
     def do_reset(self, n_ticks=60, big_tick_every_n=5, tick_interval_secs=1, final_furlong=None):
+        self.cancel_timer()
         self.is_active = False
         self.n_tick = 1
 
@@ -150,38 +249,45 @@ class Countdown(screen.Screen):
             self.final_furlong = 2 * self.big_tick_every_n
         else:
             self.final_furlong = int(final_furlong)
-        self.ticks = [None] + [("big" if t % self.big_tick_every_n == 0 else "little") for t in range(1, self.n_ticks + 1)]
+        self.tick_types = [None] + [("big" if t % self.big_tick_every_n == 0 else "little") for t in range(1, self.n_ticks + 1)]
+        self.ticks = list(self.tick_types)
+        self.geometry = {}
+        self.dials = {}
+        self.engine.audio.prepare(*set((self._tick_tone(n_tick),) for n_tick in range(1, self.n_ticks + 1)))
+        self.timeline = core.Timeline(self.tick_interval_secs, self.n_ticks)
 
         self.is_dirty = True
 
     def do_start(self):
         self.is_active = True
-        pygame.time.set_timer(core.timer_event_type, 1000 * self.tick_interval_secs)
+        self.timeline.start()
+        self.schedule_tick()
 
     def do_pause(self):
         self.is_active = False
+        self.timeline.pause()
+        self.cancel_timer()
 
     def do_stop(self):
-        pygame.time.set_timer(core.timer_event_type, 0)
-        self.is_active = False
+        self.do_pause()
 
     def do_finish(self):
-        pygame.mixer.music.load("media/alarm-clock.wav")
-        pygame.mixer.music.play()
-        pygame.time.wait(1500)
-        pygame.mixer.music.stop()
+        self.engine.audio.play("alarm-clock", maxtime=1500)
+
+    def _tick_tone(self, n_tick):
+        frequency, duration = self.sounds[self.tick_types[n_tick]]
+        if n_tick > self.n_ticks - self.final_furlong:
+            frequency *= 1.1
+        elif n_tick > self.n_ticks / 2:
+            frequency *= 1.05
+        return int(frequency), duration
 
     def do_tick(self):
-        if self.is_active:
-            self.is_dirty = True
+        if self.is_active and self.n_tick <= self.n_ticks:
             tick_type = self.ticks[self.n_tick]
+            self.changes.add(self.n_tick)
             if tick_type in self.sounds:
-                frequency, duration = self.sounds[tick_type]
-                if self.n_tick > self.n_ticks - self.final_furlong:
-                    frequency *= 1.1
-                elif self.n_tick > self.n_ticks / 2:
-                    frequency *= 1.05
-                beep(int(frequency), duration)
+                self.engine.audio.beep(self._tick_tone(self.n_tick))
             self.ticks[self.n_tick] = None
             self.n_tick += 1
             if self.n_tick > self.n_ticks:
@@ -191,55 +297,14 @@ class Countdown(screen.Screen):
     def get_countdown(self):
         return "COUNTDOWN", self.n_tick
 
-class CountdownWidget(screen.ScreenWidget):
-
-    screen = Countdown
-    name = screen.name
-
-    def widgets(self):
-        layout = QtGui.QHBoxLayout()
-        layout.addWidget(QtGui.QLabel("Ticks"))
-        self.n_ticks = QtGui.QLineEdit("60")
-        layout.addWidget(self.n_ticks)
-        layout.addWidget(QtGui.QLabel("Big ticks at"))
-        self.big_tick_every_n = QtGui.QLineEdit("5")
-        layout.addWidget(self.big_tick_every_n)
-        layout.addWidget(QtGui.QLabel("Tick interval"))
-        self.tick_interval_secs = QtGui.QLineEdit("1")
-        layout.addWidget(self.tick_interval_secs)
-        reset_countdown = QtGui.QPushButton("Reset")
-        layout.addWidget(reset_countdown)
-        self.start_pause = QtGui.QPushButton("Start")
-        layout.addWidget(self.start_pause)
-
-        reset_countdown.pressed.connect(self.on_reset)
-        self.start_pause.pressed.connect(self.on_start_pause)
-
-        return layout
-
-    def on_reset(self):
-        self.send_command(
-            "RESET",
-            self.n_ticks.text(),
-            self.big_tick_every_n.text(),
-            self.tick_interval_secs.text()
-        )
-
-    def on_start_pause(self):
-        if self.start_pause.text() == "Start":
-            self.send_command("START")
-            self.start_pause.setText("Pause")
-        else:
-            self.send_command("STOP")
-            self.start_pause.setText("Start")
-
 #
-# Scores - screen & widget
+# Scores
 #
 class Scores(screen.Screen):
 
     name = "Scores"
     _state = screen.Screen._state + []
+    depends_on = set(["scores", "names", "colours", "teams"])
 
     title_colour = screen.Screen.foreground_colour
     title_typeface = score_typeface = screen.Screen.typeface
@@ -251,23 +316,42 @@ class Scores(screen.Screen):
     def _render_team_title(self, team, surface, team_rect):
         max_height = int(self.engine.window.get_rect().height / 3.0 / 6.0)
         rect = core.Rect(team_rect.left, team_rect.top, team_rect.width, min(team_rect.height / 6, max_height)).inflate(-2, -2)
-        title_font = core.Font(self.title_typeface, rect.height - 8)
-        team_title = title_font.render(team.name, self.title_colour)
+        title_font = core.get_font(self.title_typeface, rect.height - 8)
+        team_title = core.texts.render(title_font, team.name, self.title_colour)
         surface.fill(core.Color.dark, rect)
         title_rect = team_title.get_rect()
         title_rect.center = rect.center
         surface.blit(team_title, title_rect)
 
     def _render_score(self, team, surface, team_rect):
-        score_font = core.Font(self.score_typeface, team_rect.height / 3)
-        score = score_font.render("%s" % team.score, team.text_colour)
+        score_font = core.get_font(self.score_typeface, team_rect.height / 3)
+        score = core.texts.render(score_font, "%s" % team.score, team.text_colour)
         score_rect = score.get_rect()
         score_rect.center = team_rect.center
         surface.blit(score, score_rect)
 
-    def render_even_boxes(self, surface, rect):
-        if not self.engine.teams:
-            return
+    def _render_team(self, team, surface, team_rect):
+        surface.fill(team.colour, team_rect)
+        self._render_team_title(team, surface, team_rect)
+        self._render_score(team, surface, team_rect)
+
+    def _update_teams(self, surface, team_rects, changes):
+        rects = []
+        for n_team in changes:
+            if n_team in team_rects:
+                self._render_team(self.engine.teams[n_team], surface, team_rects[n_team])
+                rects.append(team_rects[n_team])
+        return rects
+
+    def handle_change(self, event):
+        """A change to one team's score or name need only redraw that team
+        """
+        if event.what in ("scores", "names") and hasattr(event, "n_team"):
+            self.changes.add(event.n_team)
+        else:
+            super(Scores, self).handle_change(event)
+
+    def _even_boxes_rects(self, rect):
         n_teams = len(self.engine.teams)
         n_cols = 1
         while n_cols * n_cols < n_teams:
@@ -275,42 +359,49 @@ class Scores(screen.Screen):
         team_w = rect.width / n_cols
         team_h = rect.height / n_cols
 
-        score_font = core.Font(self.score_typeface, team_h / 2)
-        for n_team, team in enumerate(self.engine.teams):
+        team_rects = {}
+        for n_team in range(n_teams):
             across, down = divmod(n_team, n_cols)
-            team_rect = core.Rect(rect.left + (across * team_w), rect.top + (down * team_h), team_w, team_h).inflate(-2, -2)
-            surface.fill(team.colour, team_rect)
-            self._render_team_title(team, surface, team_rect)
-            self._render_score(team, surface, team_rect)
+            team_rects[n_team] = core.Rect(rect.left + (across * team_w), rect.top + (down * team_h), team_w, team_h).inflate(-2, -2)
+        return team_rects
 
-    def render_stacked(self, surface, rect):
+    def render_even_boxes(self, surface, rect):
         if not self.engine.teams:
             return
+        team_rects = self._even_boxes_rects(rect)
+        for n_team, team in enumerate(self.engine.teams):
+            self._render_team(team, surface, team_rects[n_team])
+
+    def update_even_boxes(self, surface, rect, changes):
+        return self._update_teams(surface, self._even_boxes_rects(rect), changes)
+
+    def _stacked_order(self):
         teams = self.engine.teams
-        height = rect.height / len(teams)
-        top = rect.top
-        for team in sorted(teams, key=lambda t: t.score, reverse=True):
-            team_rect = core.Rect(rect.left, top, rect.width, height).inflate(-2, -2)
-            surface.fill(team.colour, team_rect)
-            self._render_team_title(team, surface, team_rect)
-            self._render_score(team, surface, team_rect)
-            top += height
+        return sorted(range(len(teams)), key=lambda n_team: teams[n_team].score, reverse=True)
 
-    render_default = render_stacked
+    def _stacked_rects(self, rect, order):
+        height = rect.height / len(order)
+        return dict(
+            (n_team, core.Rect(rect.left, rect.top + n * height, rect.width, height).inflate(-2, -2))
+                for n, n_team in enumerate(order)
+        )
+
+    def render_stacked(self, surface, rect):
+        self.stacked_order = self._stacked_order()
+        if not self.stacked_order:
+            return
+        team_rects = self._stacked_rects(rect, self.stacked_order)
+        for n_team in self.stacked_order:
+            self._render_team(self.engine.teams[n_team], surface, team_rects[n_team])
 
-    def render(self, surface, rect):
+    def update_stacked(self, surface, rect, changes):
         #
-        # The default render mechanism resets to clean after
-        # a render. But we have no means of knowing when the
-        # scores change; so always consider ourselves dirty.
+        # If a score change has shuffled the order, everything moves
         #
-        super(Scores, self).render(surface, rect)
-        self.is_dirty = True
-
-class ScoresWidget(screen.ScreenWidget):
+        order = self._stacked_order()
+        if order != self.stacked_order:
+            return None
+        return self._update_teams(surface, self._stacked_rects(rect, order), changes)
 
-    name = "Scores"
-    screen = Scores
-
-_screens = dict((cls.__name__.lower(), cls) for cls in screen.Screen.__subclasses__())
-_widgets = dict((cls.name.lower(), cls) for cls in screen.ScreenWidget.__subclasses__())
+    render_default = render_stacked
+    update_default = update_stacked
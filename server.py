@@ -1,43 +1,133 @@
 import os, sys
+import socket
+import tempfile
 import threading
 import time
 
 import Pyro4
+import Pyro4.naming
+import Pyro4.socketutil
 
 class NameServer (object):
+    """Find a Pyro name server or, failing that, start one in a thread.
+    Looking is done cheapest first: the URI left by whichever process last
+    started a name server here, then localhost with a short timeout and only
+    then a broadcast to the network.
+    """
 
-    def __init__ (self):
-        try:
-            self.ns = Pyro4.naming.locateNS ()
-        except Pyro4.errors.NamingError:
-            self.event = threading.Event ()
-            self.event.set ()
-            self.thread = threading.Thread (target=self.run_nameserver)
-            self.thread.start ()
-            self.ns = Pyro4.naming.locateNS ()
-        else:
-            self.event = self.thread = None
+    uri_filepath = os.path.join (tempfile.gettempdir (), "quiz-nameserver.uri")
+    probe_timeout_secs = 0.2
+    broadcast_timeout_secs = 0.1
+
+    def __init__ (self, broadcast=True):
+        self.daemon = self.bc_server = self.thread = None
+        self.ns = self.locate (broadcast)
+        if self.ns is None:
+            self.start ()
 
     def __getattr__ (self, attr):
         return getattr (self.ns, attr)
 
+    def locate (self, broadcast=True):
+        finders = [self.from_cache, self.from_localhost]
+        if broadcast:
+            finders.append (self.from_broadcast)
+        for finder in finders:
+            ns = finder ()
+            if ns is not None:
+                return ns
+        return None
+
+    def probe (self, uri):
+        """Return a proxy for the name server at uri if one answers there
+        within probe_timeout_secs; otherwise None, as for a uri which
+        isn't one at all, eg from a truncated cache file
+        """
+        try:
+            ns = Pyro4.Proxy (uri)
+        except Pyro4.errors.PyroError:
+            return None
+        ns._pyroTimeout = self.probe_timeout_secs
+        try:
+            ns._pyroBind ()
+        except Pyro4.errors.CommunicationError:
+            ns._pyroRelease ()
+            return None
+        ns._pyroTimeout = Pyro4.config.COMMTIMEOUT or None
+        return ns
+
+    def from_cache (self):
+        try:
+            with open (self.uri_filepath) as f:
+                uri = f.read ().strip ()
+        except IOError:
+            return None
+        return self.probe (uri) if uri else None
+
+    def from_localhost (self):
+        return self.probe ("PYRO:%s@localhost:%d" % (Pyro4.constants.NAMESERVER_NAME, Pyro4.config.NS_PORT))
+
+    def from_broadcast (self):
+        sock = Pyro4.socketutil.createBroadcastSocket (timeout=self.broadcast_timeout_secs)
+        try:
+            for address in Pyro4.config.parseAddressesString (Pyro4.config.BROADCAST_ADDRS):
+                sock.sendto ("GET_NSURI", 0, (address, Pyro4.config.NS_BCPORT))
+            uri, address = sock.recvfrom (100)
+        except (socket.timeout, socket.error):
+            return None
+        finally:
+            sock.close ()
+        return self.probe (uri)
+
+    def start (self):
+        #
+        # The name server's socket is bound before its thread starts so
+        # it can be used straightaway without locating it again. It has
+        # little to do, so serve it from a single thread: that lets it
+        # share its loop with the broadcast responder and shut down without
+        # waiting on a pool of workers.
+        #
+        servertype, Pyro4.config.SERVERTYPE = Pyro4.config.SERVERTYPE, "multiplex"
+        try:
+            uri, self.daemon, self.bc_server = Pyro4.naming.startNS ()
+        finally:
+            Pyro4.config.SERVERTYPE = servertype
+        if self.bc_server:
+            self.daemon.combine (self.bc_server)
+        self.thread = threading.Thread (target=self.run_nameserver)
+        self.thread.daemon = True
+        self.thread.start ()
+        with open (self.uri_filepath, "w") as f:
+            f.write (str (uri))
+        self.ns = Pyro4.Proxy (uri)
+
     def run_nameserver (self):
-        uri, daemon, bc_server = Pyro4.naming.startNS ()
-        daemon.requestLoop (self.event.isSet)
+        self.daemon.requestLoop ()
         print "Finished daemon"
 
     def finish (self):
         print "About to finish"
+        self.ns._pyroRelease ()
         if self.thread:
-            self.event.clear ()
-            print "event cleared"
+            try:
+                os.remove (self.uri_filepath)
+            except OSError:
+                pass
+            self.daemon.shutdown ()
+            print "daemon shut down"
             self.thread.join ()
             print "thread joined"
+            if self.bc_server:
+                self.bc_server.close ()
 
 def main ():
+    started = time.time ()
     ns = NameServer ()
+    print "Name server ready in %.3fs (%s)" % (time.time () - started, "started" if ns.thread else "found")
     print ns.list ()
+    started = time.time ()
     ns.finish ()
+    print "Finished in %.3fs" % (time.time () - started)
 
 if __name__ == '__main__':
     main (*sys.argv[1:])
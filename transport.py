@@ -0,0 +1,279 @@
+"""Transports by which controllers reach the engine's instruction queue and
+feedback hub. Each transport's serve method runs in its own thread and
+feeds the same queues, so any mix of them can run side by side. Once
+clients can reach the queues, serve sets the `ready` event it's given.
+
+PyroTransport exposes the queues themselves as Pyro objects. JSONTransport
+serves newline-delimited JSON over plain TCP from a single asyncore loop:
+each line a client sends is an instruction ["ACTION", arg, ...] or a list of
+them; each line it receives is a feedback message ["MESSAGE", arg, ...].
+WireTransport works in the same way but each message is encoded by the
+wire module and preceded by its length.
+"""
+import asynchat
+import asyncore
+import json
+import select
+import socket
+import struct
+import threading
+
+import Pyro4
+
+import core
+import wire
+
+class PyroTransport(object):
+
+    name = "pyro"
+
+    def __init__(self, port=1234):
+        self.port = port
+
+    def serve(self, instructions, feedback, ready=None):
+        #
+        # Later Pyro releases only allow calls to exposed classes
+        #
+        expose = getattr(Pyro4, "expose", None)
+        if expose:
+            expose(instructions.__class__)
+            expose(feedback.__class__)
+        daemon = Pyro4.Daemon(port=self.port)
+        daemon.register(instructions, "quiz.instructions")
+        daemon.register(feedback, "quiz.feedback")
+        if ready:
+            ready.set()
+        daemon.requestLoop()
+
+class JSONChannel(asynchat.async_chat):
+    """One client connection: instructions come in a line at a time and
+    feedback goes out through the client's own subscription to the hub.
+    """
+
+    def __init__(self, sock, map, instructions, feedback):
+        asynchat.async_chat.__init__(self, sock, map=map)
+        self.set_terminator("\n")
+        self.buffer = []
+        self.instructions = instructions
+        self.feedback = feedback
+        #
+        # A connected client waits on its socket rather than on the hub, so
+        # however long it's quiet it mustn't be evicted
+        #
+        self.subscriber_id = feedback.subscribe(evictable=False)
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        line, self.buffer = "".join(self.buffer), []
+        if line.strip():
+            self.receive(line)
+
+    def encode(self, messages):
+        return "".join(json.dumps([message] + list(args), default=str) + "\n" for message, args in messages)
+
+    def receive(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            core.log.warn("Invalid instruction from %s: %r", self.addr, line)
+            return
+        batch = message if message and isinstance(message, list) and isinstance(message[0], list) else [message]
+        items = []
+        for item in batch:
+            if is_instruction(item):
+                items.append((item[0], item[1:]))
+            else:
+                core.log.warn("Invalid instruction from %s: %r", self.addr, item)
+        self.instructions.put_many(items)
+
+    def push_feedback(self):
+        try:
+            messages = self.feedback.get_batch(self.subscriber_id, timeout=0)
+        except KeyError:
+            core.log.warn("Feedback subscription for %s lapsed; subscribing again", self.addr)
+            self.subscriber_id = self.feedback.subscribe(evictable=False)
+            return
+        if messages:
+            self.push(self.encode(messages))
+
+    def handle_close(self):
+        self.feedback.unsubscribe(self.subscriber_id)
+        self.close()
+
+class Trigger(asyncore.dispatcher):
+    """Wake the asyncore loop from another thread by writing to one end of
+    a connected pair of sockets; `callback` then runs in the loop's thread.
+    """
+
+    def __init__(self, map, callback):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        self.writer = socket.create_connection(listener.getsockname())
+        reader, _ = listener.accept()
+        listener.close()
+        asyncore.dispatcher.__init__(self, reader, map=map)
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.is_pulled = False
+
+    def pull(self):
+        with self.lock:
+            if self.is_pulled:
+                return
+            self.is_pulled = True
+        self.writer.send("x")
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+        with self.lock:
+            self.is_pulled = False
+        self.callback()
+
+class WireChannel(JSONChannel):
+    """As JSONChannel but each message is encoded by the wire module and
+    preceded by its length as four bytes.
+    """
+
+    header = struct.Struct("!I")
+
+    def __init__(self, *args, **kwargs):
+        JSONChannel.__init__(self, *args, **kwargs)
+        self.set_terminator(self.header.size)
+        self.in_header = True
+
+    def found_terminator(self):
+        data, self.buffer = "".join(self.buffer), []
+        if self.in_header:
+            length, = self.header.unpack(data)
+            if length:
+                self.in_header = False
+                self.set_terminator(length)
+        else:
+            self.in_header = True
+            self.set_terminator(self.header.size)
+            self.receive(data)
+
+    def encode(self, messages):
+        return "".join(frame(wire.encode(message, args)) for message, args in messages)
+
+    def receive(self, data):
+        try:
+            action, args = wire.decode(data)
+        except (ValueError, IndexError, KeyError, TypeError):
+            action = None
+        if not isinstance(action, basestring) or not action:
+            core.log.warn("Invalid instruction from %s: %r", self.addr, data)
+            return
+        self.instructions.put(action, *args)
+
+def is_instruction(item):
+    """An instruction is a list of its action, a non-empty string, and
+    any arguments
+    """
+    return isinstance(item, list) and bool(item) and isinstance(item[0], basestring) and bool(item[0])
+
+def frame(data):
+    return WireChannel.header.pack(len(data)) + data
+
+class JSONServer(asyncore.dispatcher):
+
+    def __init__(self, address, map, instructions, feedback, channel_class):
+        asyncore.dispatcher.__init__(self, map=map)
+        self.channel_class = channel_class
+        self.instructions = instructions
+        self.feedback = feedback
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(128)
+
+    def handle_accept(self):
+        accepted = self.accept()
+        if accepted:
+            sock, address = accepted
+            self.channel_class(sock, self._map, self.instructions, self.feedback)
+
+class JSONTransport(object):
+
+    name = "json"
+    channel_class = JSONChannel
+
+    def __init__(self, port=1235, host="localhost"):
+        #
+        # Like the Pyro daemon, only listen on this machine unless told
+        # otherwise: anyone who can connect can send QUIT
+        #
+        self.port = port
+        self.host = host
+        self.map = {}
+
+    def push_feedback(self):
+        for channel in self.map.values():
+            if isinstance(channel, JSONChannel) and channel.connected:
+                channel.push_feedback()
+
+    def serve(self, instructions, feedback, ready=None):
+        JSONServer((self.host, self.port), self.map, instructions, feedback, self.channel_class)
+        feedback.add_listener(Trigger(self.map, self.push_feedback).pull)
+        if ready:
+            ready.set()
+        asyncore.loop(timeout=30.0, use_poll=hasattr(select, "poll"), map=self.map)
+
+class JSONClient(object):
+    """A minimal blocking client for JSONTransport
+    """
+
+    def __init__(self, host="localhost", port=1235):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lines = self.socket.makefile("rb")
+
+    def put(self, action, *args):
+        self.socket.sendall(json.dumps([action] + list(args)) + "\n")
+
+    def put_many(self, items):
+        self.socket.sendall(json.dumps([[action] + list(args) for action, args in items]) + "\n")
+
+    def get(self):
+        """Block until the next feedback message arrives and return it as
+        (message, args)
+        """
+        message = json.loads(self.lines.readline())
+        return message[0], tuple(message[1:])
+
+    def close(self):
+        self.lines.close()
+        self.socket.close()
+
+class WireTransport(JSONTransport):
+
+    name = "wire"
+    channel_class = WireChannel
+
+    def __init__(self, port=1236, host="localhost"):
+        JSONTransport.__init__(self, port, host)
+
+class WireClient(JSONClient):
+    """A minimal blocking client for WireTransport
+    """
+
+    def __init__(self, host="localhost", port=1236):
+        JSONClient.__init__(self, host, port)
+
+    def put(self, action, *args):
+        self.socket.sendall(frame(wire.encode(action, args)))
+
+    def put_many(self, items):
+        self.socket.sendall("".join(frame(wire.encode(action, args)) for action, args in items))
+
+    def get(self):
+        length, = WireChannel.header.unpack(self.lines.read(WireChannel.header.size))
+        return wire.decode(self.lines.read(length))
+
+transports = dict((cls.name, cls) for cls in (PyroTransport, JSONTransport, WireTransport))
@@ -0,0 +1,134 @@
+"""The controller's widgets for each kind of screen. These are kept apart
+from the screens themselves so that the engine never needs to load Qt.
+"""
+from PyQt4 import QtCore, QtGui
+
+import core
+import screen
+import screens
+
+class ScreenWidget(QtGui.QWidget):
+
+    name = ""
+    screen = screen.Screen
+
+    def __init__(self, controller, position, *args, **kwargs):
+        super(ScreenWidget, self).__init__(*args, **kwargs)
+        self.controller = controller
+        self.position = position.lower()
+
+        overall_layout = QtGui.QVBoxLayout()
+        layout = QtGui.QHBoxLayout()
+        layout.addWidget(QtGui.QLabel ("Style"))
+        self.styles = QtGui.QComboBox()
+        self.styles.addItems(self.screen._styles())
+        layout.addWidget(self.styles)
+        overall_layout.addLayout(layout)
+
+        widget_layout = self.widgets()
+        if widget_layout:
+            overall_layout.addLayout(widget_layout)
+
+        layout = QtGui.QHBoxLayout()
+        self.apply = QtGui.QPushButton("Apply")
+        layout.addWidget(self.apply)
+        overall_layout.addLayout(layout)
+
+        self.setLayout(overall_layout)
+
+        self.styles.currentIndexChanged.connect(self.on_style)
+        self.apply.clicked.connect(self.on_apply)
+
+    def widgets(self):
+        """Set up some widgets; return a layout
+        """
+        return None
+
+    def send_command(self, *args):
+        self.controller.send_command(self.position.upper(), *args)
+
+    def on_style(self, index):
+        core.log.debug("Handling style change for position %s, style %s", self.position, index)
+        core.log.debug(self.styles.itemText (index))
+        self.send_command("style", unicode(self.styles.currentText ()).encode("iso-8859-1"))
+
+    def on_apply(self):
+        raise NotImplementedError
+
+    def handle_reset(self, params):
+        if "style" in params:
+            style = params.pop("style")
+        for field, value in params.items ():
+            pass
+
+    def handle_default(self):
+        raise NotImplementedError
+
+class BlankWidget(ScreenWidget):
+
+    screen = screens.Blank
+    name = screen.name
+
+class SplashWidget(ScreenWidget):
+
+    screen = screens.Splash
+    name = screen.name
+
+    def widgets(self):
+        layout = QtGui.QHBoxLayout()
+        self.greetings = QtGui.QLineEdit("Quizzicals")
+        self.greetings.textEdited.connect(self.on_greetings)
+        layout.addWidget(self.greetings)
+        return layout
+
+    def on_greetings(self, new_greetings):
+        self.send_command("reset", new_greetings)
+
+class CountdownWidget(ScreenWidget):
+
+    screen = screens.Countdown
+    name = screen.name
+
+    def widgets(self):
+        layout = QtGui.QHBoxLayout()
+        layout.addWidget(QtGui.QLabel("Ticks"))
+        self.n_ticks = QtGui.QLineEdit("60")
+        layout.addWidget(self.n_ticks)
+        layout.addWidget(QtGui.QLabel("Big ticks at"))
+        self.big_tick_every_n = QtGui.QLineEdit("5")
+        layout.addWidget(self.big_tick_every_n)
+        layout.addWidget(QtGui.QLabel("Tick interval"))
+        self.tick_interval_secs = QtGui.QLineEdit("1")
+        layout.addWidget(self.tick_interval_secs)
+        reset_countdown = QtGui.QPushButton("Reset")
+        layout.addWidget(reset_countdown)
+        self.start_pause = QtGui.QPushButton("Start")
+        layout.addWidget(self.start_pause)
+
+        reset_countdown.pressed.connect(self.on_reset)
+        self.start_pause.pressed.connect(self.on_start_pause)
+
+        return layout
+
+    def on_reset(self):
+        self.send_command(
+            "RESET",
+            self.n_ticks.text(),
+            self.big_tick_every_n.text(),
+            self.tick_interval_secs.text()
+        )
+
+    def on_start_pause(self):
+        if self.start_pause.text() == "Start":
+            self.send_command("START")
+            self.start_pause.setText("Pause")
+        else:
+            self.send_command("STOP")
+            self.start_pause.setText("Start")
+
+class ScoresWidget(ScreenWidget):
+
+    name = "Scores"
+    screen = screens.Scores
+
+_widgets = dict((cls.name.lower(), cls) for cls in ScreenWidget.__subclasses__())
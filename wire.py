@@ -0,0 +1,203 @@
+"""A compact binary encoding for the messages which pass between controllers
+and the engine. Each message the engine knows about has an opcode and a
+fixed list of argument types; anything else, or anything whose arguments
+don't fit, falls back to opcode 0 followed by JSON.
+
+Argument types:
+
+    i - an integer, as a zigzag varint
+    s - a string, as a varint length followed by its UTF-8
+    c - an HTML-style #rrggbb colour, as three bytes
+    [x - a list of type x, as a varint count followed by the items
+    * - every remaining argument, each tagged with its own type
+"""
+import json
+
+messages = [
+    #
+    # Instructions
+    #
+    ("SCORE", "i i"),
+    ("NAME", "i s"),
+    ("SWITCH", "s s"),
+    ("LEFT", "*"),
+    ("RIGHT", "*"),
+    ("RESET", "*"),
+    #
+    # Feedback
+    #
+    ("SCORES", "[i"),
+    ("TEAMS", "[s"),
+    ("COLOURS", "[c"),
+    ("COUNTDOWN", "i"),
+]
+opcodes = dict((action, (1 + n, types.split())) for n, (action, types) in enumerate(messages))
+actions = dict((opcode, (action, types)) for action, (opcode, types) in opcodes.items())
+
+#
+# Tags for the arguments matched by *
+#
+TAG_NONE, TAG_INT, TAG_STRING, TAG_JSON = range(4)
+
+class EncodingError(Exception):
+    pass
+
+def write_varint(out, n):
+    while True:
+        byte, n = n & 0x7F, n >> 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+def read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+def write_int(out, value):
+    if isinstance(value, basestring):
+        try:
+            value = int(value)
+        except ValueError:
+            raise EncodingError("Not an integer: %r" % value)
+    if not isinstance(value, (int, long)) or isinstance(value, bool):
+        raise EncodingError("Not an integer: %r" % (value,))
+    write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+def read_int(data, pos):
+    n, pos = read_varint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+def write_string(out, value):
+    if not isinstance(value, basestring):
+        raise EncodingError("Not a string: %r" % (value,))
+    try:
+        encoded = value.encode("utf-8") if isinstance(value, unicode) else value.decode("utf-8").encode("utf-8")
+    except UnicodeError:
+        raise EncodingError("Not UTF-8: %r" % (value,))
+    write_varint(out, len(encoded))
+    out.extend(encoded)
+
+def read_string(data, pos):
+    length, pos = read_varint(data, pos)
+    return str(data[pos:pos + length]).decode("utf-8"), pos + length
+
+def write_colour(out, value):
+    try:
+        rgb = bytearray.fromhex(unicode(value).lstrip("#"))
+    except (ValueError, TypeError, UnicodeError):
+        rgb = None
+    if rgb is None or len(rgb) != 3:
+        raise EncodingError("Not a colour: %r" % (value,))
+    out.extend(rgb)
+
+def read_colour(data, pos):
+    return u"#%02x%02x%02x" % tuple(data[pos:pos + 3]), pos + 3
+
+def write_tagged(out, value):
+    if value is None:
+        out.append(TAG_NONE)
+    elif isinstance(value, (int, long)) and not isinstance(value, bool):
+        out.append(TAG_INT)
+        write_int(out, value)
+    elif isinstance(value, basestring):
+        out.append(TAG_STRING)
+        write_string(out, value)
+    else:
+        out.append(TAG_JSON)
+        try:
+            write_string(out, json.dumps(value))
+        except UnicodeError:
+            raise EncodingError("Not UTF-8: %r" % (value,))
+
+def read_tagged(data, pos):
+    tag, pos = data[pos], pos + 1
+    if tag == TAG_NONE:
+        return None, pos
+    elif tag == TAG_INT:
+        return read_int(data, pos)
+    elif tag == TAG_STRING:
+        return read_string(data, pos)
+    else:
+        text, pos = read_string(data, pos)
+        return json.loads(text), pos
+
+writers = {"i" : write_int, "s" : write_string, "c" : write_colour}
+readers = {"i" : read_int, "s" : read_string, "c" : read_colour}
+
+def _encode(out, opcode, types, args):
+    write_varint(out, opcode)
+    for n, type in enumerate(types):
+        if type == "*":
+            write_varint(out, len(args) - n)
+            for arg in args[n:]:
+                write_tagged(out, arg)
+            return
+        if n >= len(args):
+            raise EncodingError("Too few arguments")
+        if type.startswith("["):
+            write_varint(out, len(args[n]))
+            for item in args[n]:
+                writers[type[1:]](out, item)
+        else:
+            writers[type](out, args[n])
+    if len(args) > len(types):
+        raise EncodingError("Too many arguments")
+
+def encode(action, args):
+    """Encode an action and its arguments as a byte string
+    """
+    out = bytearray()
+    opcode, types = opcodes.get(action.upper(), (None, None))
+    if opcode is not None:
+        try:
+            _encode(out, opcode, types, args)
+            return str(out)
+        except EncodingError:
+            del out[:]
+    #
+    # Byte strings are usually UTF-8 but a controller may send another
+    # encoding; take anything else to be Latin-1, which any bytes will fit
+    #
+    write_varint(out, 0)
+    try:
+        out.extend(json.dumps([action] + list(args)))
+    except UnicodeError:
+        out.extend(json.dumps([action] + list(args), encoding="latin-1"))
+    return str(out)
+
+def decode(data):
+    """Decode a byte string produced by encode and return (action, args)
+    """
+    data = bytearray(data)
+    opcode, pos = read_varint(data, 0)
+    if opcode == 0:
+        message = json.loads(str(data[pos:]))
+        return message[0], tuple(message[1:])
+
+    action, types = actions[opcode]
+    args = []
+    for type in types:
+        if type == "*":
+            n_args, pos = read_varint(data, pos)
+            for n in range(n_args):
+                arg, pos = read_tagged(data, pos)
+                args.append(arg)
+        elif type.startswith("["):
+            n_items, pos = read_varint(data, pos)
+            items = []
+            for n in range(n_items):
+                item, pos = readers[type[1:]](data, pos)
+                items.append(item)
+            args.append(items)
+        else:
+            arg, pos = readers[type](data, pos)
+            args.append(arg)
+    return action, tuple(args)